@@ -6,13 +6,13 @@ import matplotlib
 matplotlib.use('Agg')  # Use Agg backend
 import matplotlib.pyplot as plt
 import seaborn as sns
-import pandas as pd
 import numpy as np
 import io
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 
 from database import DatabaseManager
+from query_executor import QueryExecutor
 
 class MatplotlibCanvas(FigureCanvas):
     def __init__(self, width=5, height=4, dpi=100):
@@ -45,6 +45,7 @@ class AnalyticsWidget(QWidget):
         
         # Initialize database manager
         self.db_manager = DatabaseManager()
+        self.executor = QueryExecutor.instance()
         
         # Create layout
         layout = QVBoxLayout(self)
@@ -132,15 +133,30 @@ class AnalyticsWidget(QWidget):
         self.update_chart()
         
     def update_chart(self):
+        """Load data for the selected chart type in the background"""
+        # A newer request on the channel supersedes one still running
+        self.executor.submit(self.load_chart_data, self.chart_combo.currentText(),
+                             channel='analytics', callback=self.render_chart)
+    
+    def load_chart_data(self, chart_type):
+        """Read the data a chart type needs; runs on a worker thread"""
+        data = {'chart_type': chart_type, 'df': self.db_manager.get_all_crab_data()}
+        
+        if chart_type == "Population Trend":
+            data['daily'] = self.db_manager.get_population_rollup('day')
+            data['monthly'] = self.db_manager.get_population_rollup('month')
+        
+        return data
+    
+    def render_chart(self, data):
         """Update charts based on selected type"""
-        # Get crab data from database
-        df = self.db_manager.get_all_crab_data()
+        df = data['df']
         
         if df.empty:
             self.show_no_data_message()
             return
         
-        chart_type = self.chart_combo.currentText()
+        chart_type = data['chart_type']
         
         if chart_type == "Population Distribution":
             self.plot_population_distribution(df)
@@ -149,7 +165,7 @@ class AnalyticsWidget(QWidget):
         elif chart_type == "Population by Location":
             self.plot_population_by_location(df)
         elif chart_type == "Population Trend":
-            self.plot_population_trend(df)
+            self.plot_population_trend(df, data['daily'], data['monthly'])
     
     def show_no_data_message(self):
         """Show message when no data is available"""
@@ -334,28 +350,16 @@ class AnalyticsWidget(QWidget):
         canvas4.axes.set_ylabel('Total Population')
         canvas4.draw()
     
-    def plot_population_trend(self, df):
-        """Plot population trend charts"""
-        # Add date column if not exists
-        if 'date_added' not in df.columns:
-            df['date_added'] = pd.Timestamp.now()
-        
-        # Convert to datetime
-        df['date_added'] = pd.to_datetime(df['date_added'])
-        
-        # Extract date components
-        df['year'] = df['date_added'].dt.year
+    def plot_population_trend(self, df, time_data, monthly_rollup):
+        """Plot population trend charts from per-day and per-month rollups"""
+        # Month of each survey point for the distribution chart
         df['month'] = df['date_added'].dt.month
-        df['day'] = df['date_added'].dt.day
         
         # Chart 1: Population over time
         canvas1 = self.chart_frames[0][1]
         canvas1.axes.clear()
         
-        time_data = df.groupby('date_added')['population'].sum().reset_index()
-        time_data = time_data.sort_values('date_added')
-        
-        canvas1.axes.plot(time_data['date_added'], time_data['population'], 
+        canvas1.axes.plot(time_data['period'], time_data['population'], 
                         marker='o', linestyle='-', color='#4a9cf5')
         canvas1.axes.set_title('Population Over Time', color='white')
         canvas1.axes.set_xlabel('Date')
@@ -368,8 +372,8 @@ class AnalyticsWidget(QWidget):
         canvas2 = self.chart_frames[1][1]
         canvas2.axes.clear()
         
-        monthly_data = df.groupby('month')['population'].sum().reset_index()
-        monthly_data = monthly_data.sort_values('month')
+        monthly_data = monthly_rollup.groupby(monthly_rollup['period'].dt.month)['population'].sum()
+        monthly_data = monthly_data.rename_axis('month').reset_index()
         
         sns.barplot(x='month', y='population', data=monthly_data, palette='Blues', ax=canvas2.axes)
         canvas2.axes.set_title('Population by Month', color='white')
@@ -394,7 +398,7 @@ class AnalyticsWidget(QWidget):
         
         time_data['cumulative'] = time_data['population'].cumsum()
         
-        canvas4.axes.plot(time_data['date_added'], time_data['cumulative'], 
+        canvas4.axes.plot(time_data['period'], time_data['cumulative'], 
                         marker='o', linestyle='-', color='#4a9cf5')
         canvas4.axes.set_title('Cumulative Population Over Time', color='white')
         canvas4.axes.set_xlabel('Date')
@@ -0,0 +1,154 @@
+import sqlite3
+
+import pandas as pd
+
+CHANGE_LOG_TABLE = 'crab_population_changes'
+
+CHANGE_LOG_SCHEMA = [
+    f'''
+    CREATE TABLE IF NOT EXISTS {CHANGE_LOG_TABLE} (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        row_id INTEGER NOT NULL,
+        op TEXT NOT NULL CHECK (op IN ('I', 'U', 'D'))
+    )
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS crab_population_log_insert
+    AFTER INSERT ON crab_population
+    BEGIN
+        INSERT INTO {CHANGE_LOG_TABLE} (row_id, op) VALUES (NEW.id, 'I');
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS crab_population_log_update
+    AFTER UPDATE ON crab_population
+    BEGIN
+        INSERT INTO {CHANGE_LOG_TABLE} (row_id, op)
+        SELECT OLD.id, 'D' WHERE OLD.id != NEW.id;
+        INSERT INTO {CHANGE_LOG_TABLE} (row_id, op)
+        VALUES (NEW.id, CASE WHEN OLD.id = NEW.id THEN 'U' ELSE 'I' END);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS crab_population_log_delete
+    AFTER DELETE ON crab_population
+    BEGIN
+        INSERT INTO {CHANGE_LOG_TABLE} (row_id, op) VALUES (OLD.id, 'D');
+    END
+    '''
+]
+
+# Random id stamped into every database once. Tokens only order the
+# changes of one database, so whatever is cached under a token on disk
+# also records this id
+DATABASE_ID_TABLE = 'database_identity'
+
+DATABASE_ID_SCHEMA = [
+    f'''
+    CREATE TABLE IF NOT EXISTS {DATABASE_ID_TABLE} (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        database_id TEXT NOT NULL
+    )
+    ''',
+    f'''
+    INSERT OR IGNORE INTO {DATABASE_ID_TABLE} (id, database_id)
+    VALUES (1, lower(hex(randomblob(16))))
+    '''
+]
+
+ROW_COLUMNS = ['id', 'population', 'latitude', 'longitude', 'date_added']
+
+def current_token(conn):
+    """Return the sequence number of the latest logged change"""
+    row = conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = ?", (CHANGE_LOG_TABLE,)
+    ).fetchone()
+    return row[0] if row else 0
+
+def database_id(conn):
+    """Return the id stamped into the database, or None before it has one"""
+    try:
+        row = conn.execute(f"SELECT database_id FROM {DATABASE_ID_TABLE} WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+def read_changes(conn, token):
+    """Read the net changes to crab_population after a change token.
+    
+    Returns a dict with 'token' (pass it to the next call), 'reset' (True
+    when the caller must reload everything because the token is unknown or
+    the log has been pruned past it), 'inserted' and 'updated' DataFrames
+    holding the current rows, and 'deleted', a list of removed ids.
+    """
+    changes = {
+        'token': 0,
+        'reset': False,
+        'inserted': pd.DataFrame(columns=ROW_COLUMNS),
+        'updated': pd.DataFrame(columns=ROW_COLUMNS),
+        'deleted': []
+    }
+    
+    # Read the log and the rows from one snapshot
+    owns_transaction = not conn.in_transaction
+    if owns_transaction:
+        conn.execute("BEGIN")
+    try:
+        latest = current_token(conn)
+        changes['token'] = latest
+        
+        oldest = conn.execute(f"SELECT MIN(seq) FROM {CHANGE_LOG_TABLE}").fetchone()[0]
+        pruned = token is not None and token < latest and (oldest is None or token < oldest - 1)
+        if token is None or token > latest or pruned:
+            changes['reset'] = True
+            return changes
+        
+        if token == latest:
+            return changes
+        
+        # Collapse every row's history to its first and last operation
+        net_ops = conn.execute(f'''
+            SELECT w.row_id, f.op, l.op
+            FROM (
+                SELECT row_id, MIN(seq) AS first_seq, MAX(seq) AS last_seq
+                FROM {CHANGE_LOG_TABLE}
+                WHERE seq > ? AND seq <= ?
+                GROUP BY row_id
+            ) w
+            JOIN {CHANGE_LOG_TABLE} f ON f.seq = w.first_seq
+            JOIN {CHANGE_LOG_TABLE} l ON l.seq = w.last_seq
+        ''', (token, latest)).fetchall()
+        
+        inserted_ids = []
+        updated_ids = []
+        for row_id, first_op, last_op in net_ops:
+            if last_op == 'D':
+                # Rows inserted and deleted inside the window never existed
+                if first_op != 'I':
+                    changes['deleted'].append(row_id)
+            elif first_op == 'I':
+                inserted_ids.append(row_id)
+            else:
+                updated_ids.append(row_id)
+        
+        if inserted_ids or updated_ids:
+            rows = pd.read_sql_query(f'''
+                SELECT {', '.join(ROW_COLUMNS)} FROM crab_population
+                WHERE id IN (
+                    SELECT DISTINCT row_id FROM {CHANGE_LOG_TABLE}
+                    WHERE seq > ? AND seq <= ?
+                )
+            ''', conn, params=(token, latest))
+            changes['inserted'] = rows[rows['id'].isin(inserted_ids)].reset_index(drop=True)
+            changes['updated'] = rows[rows['id'].isin(updated_ids)].reset_index(drop=True)
+        
+        return changes
+    finally:
+        if owns_transaction and conn.in_transaction:
+            conn.rollback()
+
+def prune_changes(conn, keep=100000):
+    """Delete all but the most recent change log entries"""
+    latest = current_token(conn)
+    cursor = conn.execute(f"DELETE FROM {CHANGE_LOG_TABLE} WHERE seq <= ?", (latest - keep,))
+    return cursor.rowcount
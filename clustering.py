@@ -0,0 +1,302 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+import change_log
+
+# Columns summed per cell; id_sum is the point id of single-point cells
+LEVEL_COLUMNS = ['count', 'population', 'sum_x', 'sum_y', 'id_sum']
+
+CLUSTER_COLUMNS = ['cluster_id', 'latitude', 'longitude', 'count', 'population', 'point_id']
+
+def project(latitude, longitude):
+    """Web Mercator x, y in [0, 1], y growing southwards like tile rows"""
+    x = (np.asarray(longitude, dtype=np.float64) + 180.0) / 360.0
+    sin_lat = np.clip(np.sin(np.radians(np.asarray(latitude, dtype=np.float64))), -0.9999, 0.9999)
+    y = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)
+    return np.clip(x, 0.0, 1.0), np.clip(y, 0.0, 1.0)
+
+def unproject(x, y):
+    """Latitude and longitude of Web Mercator x, y"""
+    longitude = np.asarray(x) * 360.0 - 180.0
+    latitude = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y)))))
+    return latitude, longitude
+
+def _spread_bits(values):
+    """Insert a zero bit after each of the low 20 bits"""
+    v = values.astype(np.int64) & 0xFFFFF
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    return (v | (v << 1)) & 0x5555555555555555
+
+def _compact_bits(values):
+    """Inverse of _spread_bits"""
+    v = values.astype(np.int64) & 0x5555555555555555
+    v = (v | (v >> 1)) & 0x3333333333333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF00FF00FF
+    v = (v | (v >> 8)) & 0x0000FFFF0000FFFF
+    return (v | (v >> 16)) & 0xFFFFF
+
+def morton(column, row):
+    """Z-order key of grid cells; a cell's parent one zoom out is key >> 2"""
+    return _spread_bits(column) | (_spread_bits(row) << 1)
+
+class ClusterIndex:
+    """Hierarchical point clusters for the map, in the style of supercluster.
+    
+    Points are projected to Web Mercator and binned into a quadtree of
+    grid cells RADIUS pixels wide at each zoom from MIN_ZOOM to MAX_ZOOM;
+    every cell with points is a cluster located at their centroid. The
+    cells are keyed in Z-order, so the cells of a zoom level are the keys
+    of the next level shifted by two bits: one sort of the points builds
+    every level, and a cluster's children are the up to four cells under
+    it one zoom in.
+    
+    Each level keeps per-cell sums only, so the change log deltas are
+    applied by adding and subtracting the changed points rather than by
+    rebuilding; a different population threshold rebuilds the levels from
+    the points already in memory.
+    """
+    MIN_ZOOM = 0
+    MAX_ZOOM = 16
+    RADIUS = 40
+    TILE_SIZE = 256
+    
+    # Cluster ids pack the cell key above the zoom, which takes 5 bits
+    ZOOM_BITS = 5
+    
+    # Deltas touching more than this fraction of the points trigger a reload
+    MAX_DELTA_FRACTION = 0.5
+    
+    _instances = {}
+    _instances_lock = threading.Lock()
+    
+    @classmethod
+    def for_connections(cls, connections):
+        """Return the shared index for a connection manager"""
+        with cls._instances_lock:
+            index = cls._instances.get(connections.db_path)
+            if index is None or index.connections is not connections:
+                index = cls(connections)
+                cls._instances[connections.db_path] = index
+            return index
+    
+    def __init__(self, connections):
+        self.connections = connections
+        self.min_population = 0
+        self._points = None
+        self._levels = None
+        self._version = None
+        self._token = None
+        self._lock = threading.Lock()
+        
+        # Grid cell width at MAX_ZOOM in projected units; 20 bits per axis
+        # cover the 2**16 * 256 / 40 cells across the world at that zoom
+        self._cell_size = self.RADIUS / (self.TILE_SIZE * 2 ** self.MAX_ZOOM)
+    
+    def get_clusters(self, bbox, zoom, min_population=0):
+        """Clusters overlapping bbox (south, west, north, east) at a zoom level.
+        
+        Beyond MAX_ZOOM every point is its own cluster. Returns a DataFrame
+        with 'cluster_id', 'latitude', 'longitude', 'count', 'population'
+        and 'point_id', the survey id of single-point clusters and -1
+        otherwise. Only points with at least min_population crabs count.
+        """
+        with self._lock:
+            self._update(min_population)
+            
+            zoom = max(int(zoom), self.MIN_ZOOM)
+            if zoom > self.MAX_ZOOM:
+                south, west, north, east = bbox
+                points = self._points
+                inside = (points['population'].to_numpy() >= self.min_population) \
+                    & points['latitude'].between(south, north).to_numpy() \
+                    & points['longitude'].between(west, east).to_numpy()
+                return self._point_clusters(points[inside])
+            
+            level = self._levels[zoom]
+            columns, rows = self._cell_range(bbox, zoom)
+            keys = level.index.to_numpy()
+            
+            # Every cell in the box has a key between those of its corners
+            low = np.searchsorted(keys, morton(columns[0], rows[0]), side='left')
+            high = np.searchsorted(keys, morton(columns[1], rows[1]), side='right')
+            candidates = level.iloc[low:high]
+            cells = candidates.index.to_numpy()
+            column, row = _compact_bits(cells), _compact_bits(cells >> 1)
+            inside = (column >= columns[0]) & (column <= columns[1]) & (row >= rows[0]) & (row <= rows[1])
+            return self._describe(candidates[inside], zoom)
+    
+    def get_cluster_children(self, cluster_id, min_population=0):
+        """Clusters one zoom level in from a cluster, or its points at MAX_ZOOM.
+        
+        min_population must match the get_clusters call the id came from.
+        """
+        with self._lock:
+            self._update(min_population)
+            
+            cluster_id = int(cluster_id)
+            zoom = cluster_id & ((1 << self.ZOOM_BITS) - 1)
+            cell = cluster_id >> self.ZOOM_BITS
+            if zoom >= self.MAX_ZOOM:
+                points = self._points
+                members = (points['cell'].to_numpy() == cell) \
+                    & (points['population'].to_numpy() >= self.min_population)
+                return self._point_clusters(points[members])
+            
+            level = self._levels[zoom + 1]
+            children = level.reindex((cell << 2) + np.arange(4)).dropna()
+            return self._describe(children, zoom + 1)
+    
+    def get_points(self, ids):
+        """Survey rows of the given ids, for single-point clusters"""
+        with self._lock:
+            self._update(self.min_population)
+            points = self._points
+            return points.loc[points.index.intersection(ids),
+                              ['population', 'latitude', 'longitude', 'date_added']]
+    
+    def _cell_range(self, bbox, zoom):
+        """Grid columns and rows spanned by bbox at a zoom level"""
+        south, west, north, east = bbox
+        size = self._cell_size * 2 ** (self.MAX_ZOOM - zoom)
+        x, y = project([north, south], [west, east])
+        columns = (x / size).astype(np.int64)
+        rows = (y / size).astype(np.int64)
+        limit = int(np.ceil(1 / size)) - 1
+        return np.clip(columns, 0, limit), np.clip(rows, 0, limit)
+    
+    def _describe(self, cells, zoom):
+        """Cluster rows of level cells"""
+        count = cells['count'].to_numpy(dtype=np.int64)
+        latitude, longitude = unproject(cells['sum_x'].to_numpy() / count,
+                                        cells['sum_y'].to_numpy() / count)
+        return pd.DataFrame({
+            'cluster_id': (cells.index.to_numpy(dtype=np.int64) << self.ZOOM_BITS) | zoom,
+            'latitude': latitude,
+            'longitude': longitude,
+            'count': count,
+            'population': cells['population'].to_numpy(dtype=np.int64),
+            'point_id': np.where(count == 1, cells['id_sum'].to_numpy(dtype=np.int64), -1)
+        })
+    
+    def _point_clusters(self, points):
+        """Cluster rows for individual points"""
+        return pd.DataFrame({
+            'cluster_id': -1,
+            'latitude': points['latitude'].to_numpy(),
+            'longitude': points['longitude'].to_numpy(),
+            'count': 1,
+            'population': points['population'].to_numpy(dtype=np.int64),
+            'point_id': points.index.to_numpy(dtype=np.int64)
+        }, columns=CLUSTER_COLUMNS)
+    
+    def _update(self, min_population):
+        """Bring the points and levels up to date with the database"""
+        # Read the version before the data so a concurrent commit can only
+        # cause an extra refresh, never a missed one
+        version = self.connections.data_version()
+        
+        if self._points is None:
+            self._load()
+        elif version != self._version:
+            self._refresh()
+        self._version = version
+        
+        if self._levels is None or min_population != self.min_population:
+            self.min_population = min_population
+            self._levels = self._aggregate(self._visible(self._points))
+    
+    def _load(self):
+        """Read every point and its change token from one snapshot"""
+        with self.connections.reader() as conn:
+            conn.execute("BEGIN")
+            token = change_log.current_token(conn)
+            df = pd.read_sql_query(
+                f"SELECT {', '.join(change_log.ROW_COLUMNS)} FROM crab_population", conn
+            )
+        
+        self._points = self._prepare(df)
+        self._token = token
+        self._levels = None
+    
+    def _refresh(self):
+        """Apply the change log since the last refresh to the points and levels"""
+        with self.connections.reader() as conn:
+            changes = change_log.read_changes(conn, self._token)
+        
+        touched = len(changes['inserted']) + len(changes['updated']) + len(changes['deleted'])
+        if changes['reset'] or touched > len(self._points) * self.MAX_DELTA_FRACTION:
+            self._load()
+            return
+        
+        if touched:
+            stale_ids = self._points.index.intersection(
+                pd.Index(changes['deleted']).union(changes['updated']['id']).union(changes['inserted']['id'])
+            )
+            removed = self._points.loc[stale_ids]
+            parts = [part for part in (changes['updated'], changes['inserted']) if not part.empty]
+            added = self._prepare(pd.concat(parts, ignore_index=True) if parts
+                                  else pd.DataFrame(columns=change_log.ROW_COLUMNS))
+            self._points = pd.concat([self._points.drop(stale_ids), added])
+            
+            if self._levels is not None:
+                removed_levels = self._aggregate(self._visible(removed))
+                added_levels = self._aggregate(self._visible(added))
+                for zoom, level in self._levels.items():
+                    level = level.add(added_levels[zoom], fill_value=0)
+                    level = level.sub(removed_levels[zoom], fill_value=0)
+                    self._levels[zoom] = level[level['count'] > 0].astype(
+                        {'count': np.int64, 'population': np.int64, 'id_sum': np.int64}
+                    )
+        
+        self._token = changes['token']
+    
+    def _prepare(self, df):
+        """Index rows by id with their projected position and MAX_ZOOM cell"""
+        x, y = project(df['latitude'].to_numpy(dtype=np.float64), df['longitude'].to_numpy(dtype=np.float64))
+        limit = int(np.ceil(1 / self._cell_size)) - 1
+        columns = np.clip((x / self._cell_size).astype(np.int64), 0, limit)
+        rows = np.clip((y / self._cell_size).astype(np.int64), 0, limit)
+        
+        return pd.DataFrame({
+            'population': df['population'].to_numpy(dtype=np.int64),
+            'latitude': df['latitude'].to_numpy(dtype=np.float64),
+            'longitude': df['longitude'].to_numpy(dtype=np.float64),
+            'date_added': df['date_added'].to_numpy(),
+            'x': x,
+            'y': y,
+            'cell': morton(columns, rows)
+        }, index=pd.Index(df['id'].to_numpy(dtype=np.int64), name='id'))
+    
+    def _visible(self, points):
+        return points[points['population'].to_numpy() >= self.min_population]
+    
+    def _aggregate(self, points):
+        """Per-cell sums at every zoom level, from one sort of the points"""
+        order = np.argsort(points['cell'].to_numpy(), kind='stable')
+        cells = points['cell'].to_numpy()[order]
+        values = {
+            'count': np.ones(len(points), dtype=np.int64),
+            'population': points['population'].to_numpy()[order],
+            'sum_x': points['x'].to_numpy()[order],
+            'sum_y': points['y'].to_numpy()[order],
+            'id_sum': points.index.to_numpy(dtype=np.int64)[order]
+        }
+        
+        levels = {}
+        for zoom in range(self.MAX_ZOOM, self.MIN_ZOOM - 1, -1):
+            keys = cells >> (2 * (self.MAX_ZOOM - zoom))
+            if len(keys):
+                starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+                sums = {name: np.add.reduceat(column, starts) for name, column in values.items()}
+            else:
+                starts = np.empty(0, dtype=np.int64)
+                sums = {name: column[:0] for name, column in values.items()}
+            levels[zoom] = pd.DataFrame(sums, index=pd.Index(keys[starts], name='cell'),
+                                        columns=LEVEL_COLUMNS)
+        return levels
@@ -0,0 +1,225 @@
+import os
+import threading
+import time
+
+import pandas as pd
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+
+class ImportCancelled(Exception):
+    """Raised inside the import transaction to roll it back"""
+
+class CsvImporter(QObject):
+    """Streams a CSV file into crab_population in fixed-size chunks.
+    
+    All chunks are inserted with executemany inside a single writer
+    transaction, so a failed or cancelled import leaves the table untouched.
+    run() can be called directly or from a worker QThread.
+    
+    In 'append' mode an ID that already exists fails the import. In 'merge'
+    mode each chunk is staged in a temp table and applied with one
+    INSERT ... ON CONFLICT(id) DO UPDATE; counts of inserted, updated and
+    unchanged rows are kept in self.counts.
+    
+    An optional Date column holds the survey date of each row; it becomes
+    the observed_at of the matching observations.
+    """
+    progress = pyqtSignal(int, float)  # rows imported, rows per second
+    finished = pyqtSignal(bool, str)   # success, message
+    
+    REQUIRED_COLUMNS = ['ID', 'Population', 'Latitude', 'Longitude']
+    DATE_COLUMN = 'Date'
+    MODES = ('append', 'merge')
+    CHUNK_SIZE = 50000
+    
+    # Files above this size are loaded with secondary indexes and triggers
+    # dropped; indexes are rebuilt and the trigger side effects applied
+    # set-based once at the end instead of row by row
+    LARGE_IMPORT_BYTES = 32 * 1024 * 1024
+    
+    def __init__(self, db_manager, csv_path, chunk_size=None, mode='append'):
+        super().__init__()
+        
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown import mode: {mode}")
+        
+        self.db_manager = db_manager
+        self.csv_path = csv_path
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.mode = mode
+        
+        self.rows_imported = 0
+        self.counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        self.message = ""
+        self.error = None
+        self._cancel_event = threading.Event()
+    
+    def cancel(self):
+        """Ask a running import to stop; safe to call from any thread"""
+        self._cancel_event.set()
+    
+    @pyqtSlot()
+    def run(self):
+        """Import the file, returning True on success"""
+        try:
+            header = pd.read_csv(self.csv_path, nrows=0)
+            missing_cols = [col for col in self.REQUIRED_COLUMNS if col not in header.columns]
+            if missing_cols:
+                return self._finish(False, f"CSV file missing required columns: {', '.join(missing_cols)}")
+            
+            # The set-based path needs every migration in place
+            large_import = (os.path.getsize(self.csv_path) >= self.LARGE_IMPORT_BYTES
+                            and self.db_manager.migrated())
+            merge = self.mode == 'merge'
+            has_dates = self.DATE_COLUMN in header.columns
+            columns = self.REQUIRED_COLUMNS + ([self.DATE_COLUMN] if has_dates else [])
+            started = time.perf_counter()
+            
+            with self.db_manager.connections.writer() as conn:
+                deferred = self._drop_schema_objects(conn, 'index') if large_import else []
+                if merge:
+                    conn.execute('''
+                        CREATE TEMP TABLE IF NOT EXISTS import_stage (
+                            id INTEGER PRIMARY KEY,
+                            population INTEGER NOT NULL,
+                            latitude REAL NOT NULL,
+                            longitude REAL NOT NULL
+                        )
+                    ''')
+                elif large_import:
+                    # Updates in merge mode need the triggers, appends can defer them
+                    deferred += self._drop_schema_objects(conn, 'trigger')
+                    conn.execute("CREATE TEMP TABLE IF NOT EXISTS import_ids (id INTEGER PRIMARY KEY)")
+                    conn.execute("DELETE FROM temp.import_ids")
+                
+                if has_dates:
+                    conn.execute("CREATE TEMP TABLE IF NOT EXISTS import_dates "
+                                 "(id INTEGER PRIMARY KEY, observed_at TEXT NOT NULL)")
+                    conn.execute("DELETE FROM temp.import_dates")
+                
+                chunks = pd.read_csv(self.csv_path, usecols=columns, chunksize=self.chunk_size)
+                for chunk in chunks:
+                    if self._cancel_event.is_set():
+                        raise ImportCancelled()
+                    
+                    if merge:
+                        self._merge_chunk(conn, chunk)
+                    else:
+                        self._insert_chunk(conn, chunk, track_ids=large_import)
+                    if has_dates:
+                        self._stage_dates(conn, chunk)
+                    self.rows_imported += len(chunk)
+                    
+                    elapsed = time.perf_counter() - started
+                    self.progress.emit(self.rows_imported, self.rows_imported / elapsed if elapsed else 0.0)
+                
+                for sql in deferred:
+                    conn.execute(sql)
+                if merge:
+                    conn.execute("DELETE FROM temp.import_stage")
+                elif large_import:
+                    self.db_manager.sync_inserted_rows(conn, 'temp.import_ids')
+                    conn.execute("DELETE FROM temp.import_ids")
+                
+                # Survey dates are applied once the observations exist
+                if has_dates:
+                    conn.execute('''
+                        UPDATE observations SET observed_at = d.observed_at
+                        FROM temp.import_dates d
+                        WHERE observations.source_id = d.id
+                    ''')
+                    conn.execute("DELETE FROM temp.import_dates")
+            
+            elapsed = time.perf_counter() - started
+            message = f"Imported {self.rows_imported:,} rows in {elapsed:.1f} s"
+            if merge:
+                message += (f" ({self.counts['inserted']:,} new, {self.counts['updated']:,} updated, "
+                            f"{self.counts['unchanged']:,} unchanged)")
+            return self._finish(True, message)
+            
+        except ImportCancelled:
+            self._reset_counts()
+            return self._finish(False, "Import cancelled")
+        except Exception as e:
+            self._reset_counts()
+            self.error = e
+            return self._finish(False, f"Error importing CSV: {str(e)}")
+    
+    def _insert_chunk(self, conn, chunk, track_ids=False):
+        """Insert one chunk of CSV rows"""
+        # tolist() converts NumPy scalars to Python types sqlite3 can bind
+        rows = list(zip(*(chunk[col].tolist() for col in self.REQUIRED_COLUMNS)))
+        conn.executemany('''
+            INSERT INTO crab_population (id, population, latitude, longitude)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        
+        if track_ids:
+            conn.executemany("INSERT INTO temp.import_ids (id) VALUES (?)",
+                             ((row[0],) for row in rows))
+    
+    def _merge_chunk(self, conn, chunk):
+        """Upsert one chunk of CSV rows through the staging table"""
+        rows = zip(*(chunk[col].tolist() for col in self.REQUIRED_COLUMNS))
+        
+        # Later rows win when an ID repeats within the chunk
+        conn.execute("DELETE FROM temp.import_stage")
+        conn.executemany('''
+            INSERT OR REPLACE INTO temp.import_stage (id, population, latitude, longitude)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        
+        staged, inserted, unchanged = conn.execute('''
+            SELECT COUNT(*),
+                   COALESCE(SUM(c.id IS NULL), 0),
+                   COALESCE(SUM(c.population IS s.population
+                                AND c.latitude IS s.latitude
+                                AND c.longitude IS s.longitude), 0)
+            FROM temp.import_stage s
+            LEFT JOIN crab_population c ON c.id = s.id
+        ''').fetchone()
+        
+        conn.execute('''
+            INSERT INTO crab_population (id, population, latitude, longitude)
+            SELECT id, population, latitude, longitude FROM temp.import_stage WHERE true
+            ON CONFLICT (id) DO UPDATE SET
+                population = excluded.population,
+                latitude = excluded.latitude,
+                longitude = excluded.longitude
+            WHERE population IS NOT excluded.population
+               OR latitude IS NOT excluded.latitude
+               OR longitude IS NOT excluded.longitude
+        ''')
+        
+        self.counts['inserted'] += inserted
+        self.counts['updated'] += staged - inserted - unchanged
+        self.counts['unchanged'] += unchanged
+    
+    def _stage_dates(self, conn, chunk):
+        """Keep the parsed survey dates of one chunk until the import ends"""
+        dates = pd.to_datetime(chunk[self.DATE_COLUMN], errors='coerce')
+        valid = dates.notna()
+        conn.executemany(
+            "INSERT OR REPLACE INTO temp.import_dates (id, observed_at) VALUES (?, ?)",
+            zip(chunk.loc[valid, 'ID'].tolist(), dates[valid].dt.strftime('%Y-%m-%d %H:%M:%S').tolist())
+        )
+    
+    def _reset_counts(self):
+        self.rows_imported = 0
+        self.counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    
+    def _drop_schema_objects(self, conn, object_type):
+        """Drop the explicit indexes or triggers on crab_population, returning their DDL"""
+        objects = conn.execute('''
+            SELECT name, sql FROM sqlite_master
+            WHERE type = ? AND tbl_name = 'crab_population' AND sql IS NOT NULL
+        ''', (object_type,)).fetchall()
+        
+        for name, _ in objects:
+            conn.execute(f'DROP {object_type.upper()} "{name}"')
+        
+        return [sql for _, sql in objects]
+    
+    def _finish(self, success, message):
+        self.message = message
+        self.finished.emit(success, message)
+        return success
@@ -6,10 +6,11 @@ import matplotlib
 matplotlib.use('Agg')
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
-import pandas as pd
 import numpy as np
 
 from database import DatabaseManager
+from query_executor import QueryExecutor
+from settings_service import SettingsService
 
 class DashboardWidget(QWidget):
     def __init__(self):
@@ -17,6 +18,7 @@ class DashboardWidget(QWidget):
         
         # Initialize database manager
         self.db_manager = DatabaseManager()
+        self.executor = QueryExecutor.instance()
         
         # Create layout
         layout = QVBoxLayout(self)
@@ -152,14 +154,25 @@ class DashboardWidget(QWidget):
         
         layout.addLayout(charts_grid)
         
+        # Change token of the data currently shown
+        self.change_token = None
+        
         # Set up timer for periodic updates
+        self.settings = SettingsService.instance()
+        self.settings.settings_changed.connect(self.on_settings_changed)
+        
         self.update_timer = QTimer(self)
         self.update_timer.timeout.connect(self.update_dashboard)
-        self.update_timer.start(5000)  # Update every 5 seconds
+        self.update_timer.start(self.settings.get('refresh_interval') * 1000)
         
         # Initial update
         self.update_dashboard()
     
+    def on_settings_changed(self, keys):
+        """Apply changed settings"""
+        if 'refresh_interval' in keys:
+            self.update_timer.setInterval(self.settings.get('refresh_interval') * 1000)
+    
     def create_stat_card(self, title, value, icon_path=None):
         """Create a statistics card widget"""
         card = QFrame()
@@ -197,50 +210,73 @@ class DashboardWidget(QWidget):
         return card
     
     def update_dashboard(self):
+        """Refresh the dashboard data in the background"""
+        self.executor.submit(self.load_dashboard_data, self.change_token,
+                             channel='dashboard', callback=self.render_dashboard)
+    
+    def load_dashboard_data(self, change_token):
+        """Read everything the dashboard shows; runs on a worker thread.
+        
+        Returns None when nothing changed since change_token.
+        """
+        token = self.db_manager.get_change_token()
+        if token is not None and token == change_token:
+            return None
+        
+        return {
+            'token': token,
+            'df': self.db_manager.get_all_crab_data(),
+            'stats': self.db_manager.get_summary_stats(include_archived=False),
+            'trend': self.db_manager.get_population_rollup('day')
+        }
+    
+    def render_dashboard(self, data):
         """Update dashboard with latest data"""
-        # Get crab data from database
-        df = self.db_manager.get_all_crab_data()
+        # Nothing changed since the last tick
+        if data is None:
+            return
+        
+        self.change_token = data['token']
+        df = data['df']
         
         if df.empty:
             self.show_no_data_message()
             return
         
-        # Update stats cards
-        total_pop = df['population'].sum()
+        # Update stats cards from the trigger-maintained summary; they cover
+        # the live table, like the distribution and location charts
+        stats = data['stats']
+        
+        total_pop = stats['total_population']
         self.total_pop_card.findChild(QLabel, "total_population_value").setText(f"{total_pop:,}")
         
-        total_loc = len(df)
+        total_loc = stats['total_locations']
         self.total_loc_card.findChild(QLabel, "total_locations_value").setText(f"{total_loc:,}")
         
-        avg_pop = df['population'].mean()
+        avg_pop = stats['average_population']
         self.avg_pop_card.findChild(QLabel, "average_population_value").setText(f"{avg_pop:.1f}")
         
-        max_pop = df['population'].max()
+        max_pop = stats['max_population']
         self.max_pop_card.findChild(QLabel, "highest_population_value").setText(f"{max_pop:,}")
         
         # Update trend chart
         self.trend_axes.clear()
         
-        # Convert to datetime if not already
-        if 'date_added' in df.columns:
-            df['date_added'] = pd.to_datetime(df['date_added'])
-            
-            # Group by date and sum population
-            trend_data = df.groupby(df['date_added'].dt.date)['population'].sum().reset_index()
-            trend_data = trend_data.sort_values('date_added')
-            
-            if len(trend_data) > 1:
-                self.trend_axes.plot(trend_data['date_added'], trend_data['population'], 
-                                   marker='o', linestyle='-', color='#4a9cf5')
-                self.trend_axes.set_xlabel('Date')
-                self.trend_axes.set_ylabel('Total Population')
-                self.trend_axes.grid(True, alpha=0.3)
-                self.trend_canvas.figure.autofmt_xdate()
-            else:
-                self.trend_axes.text(0.5, 0.5, "Not enough time data for trend analysis",
-                                   horizontalalignment='center', verticalalignment='center',
-                                   color='white', fontsize=12, transform=self.trend_axes.transAxes)
-                self.trend_axes.set_axis_off()
+        # Daily totals come pre-aggregated from the rollup table
+        trend_data = data['trend']
+        
+        if len(trend_data) > 1:
+            self.trend_axes.plot(trend_data['period'], trend_data['population'], 
+                               marker='o', linestyle='-', color='#4a9cf5')
+            self.trend_axes.set_xlabel('Date')
+            self.trend_axes.set_ylabel('Total Population')
+            self.trend_axes.grid(True, alpha=0.3)
+            self.trend_canvas.figure.autofmt_xdate()
+        elif len(trend_data) == 1:
+            self.trend_axes.text(0.5, 0.5, "Not enough time data for trend analysis",
+                               horizontalalignment='center', verticalalignment='center',
+                               color='white', fontsize=12, transform=self.trend_axes.transAxes)
+            self.trend_axes.set_axis_off()
         else:
             self.trend_axes.text(0.5, 0.5, "No time data available",
                                horizontalalignment='center', verticalalignment='center',
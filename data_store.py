@@ -0,0 +1,279 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import change_log
+
+# Sentinel SQLite hands back for missing dates; reinterpreted as NaT
+NAT_SECONDS = np.iinfo(np.int64).min
+
+def integer_dtype(min_value, max_value):
+    """Smallest of int32/int64 that holds the given range"""
+    info = np.iinfo(np.int32)
+    if min_value is None or (info.min <= min_value and max_value <= info.max):
+        return np.int32
+    return np.int64
+
+def compact_frame(df):
+    """Convert a crab_population frame read with pd.read_sql_query to the
+    compact dtypes used by the store"""
+    if df.empty:
+        return df.astype({'id': np.int32, 'population': np.int32,
+                          'latitude': np.float64, 'longitude': np.float64,
+                          'date_added': 'datetime64[s]'})
+    
+    return df.astype({
+        'id': integer_dtype(df['id'].min(), df['id'].max()),
+        'population': integer_dtype(df['population'].min(), df['population'].max()),
+        'latitude': np.float64,
+        'longitude': np.float64
+    }).assign(date_added=pd.to_datetime(df['date_added'], errors='coerce').astype('datetime64[s]'))
+
+class CrabDataStore:
+    """Process-wide in-memory copy of the crab_population table.
+    
+    The table is read once into compact typed columns: int32 ids and
+    populations when they fit, float64 coordinates and a datetime64[s]
+    date_added parsed by SQLite. Every request first checks the database
+    data_version; when something was committed the store applies the
+    change log delta, and only falls back to re-reading the whole table
+    when the delta is large or no longer available.
+    
+    The columns are also saved as .npy files next to the database, stamped
+    with the database id and the change log token. A cold start of the same
+    database memory-maps that snapshot and catches up through the change
+    log instead of reading the table; the snapshot itself is rewritten on a
+    background thread.
+    """
+    COLUMNS = change_log.ROW_COLUMNS
+    
+    # Rows fetched per cursor batch while loading
+    FETCH_BATCH = 65536
+    
+    # Deltas touching more than this fraction of the table trigger a reload
+    MAX_DELTA_FRACTION = 0.5
+    
+    SNAPSHOT_FORMAT = 1
+    
+    # Rewrite the snapshot once it lags the table by this many changes
+    SNAPSHOT_MIN_CHANGES = 10000
+    
+    _instances = {}
+    _instances_lock = threading.Lock()
+    
+    @classmethod
+    def for_connections(cls, connections):
+        """Return the shared store for a connection manager"""
+        with cls._instances_lock:
+            store = cls._instances.get(connections.db_path)
+            if store is None or store.connections is not connections:
+                store = cls(connections)
+                cls._instances[connections.db_path] = store
+            return store
+    
+    def __init__(self, connections):
+        self.connections = connections
+        self._frame = None
+        self._version = None
+        self._token = None
+        self._database_id = None
+        self._lock = threading.Lock()
+        
+        self.snapshot_dir = connections.db_path + '.snapshot'
+        self._snapshot_token = None
+        self._snapshot_thread = None
+    
+    def get_frame(self):
+        """Return a read-only view of the cached table, refreshing if stale"""
+        # Read the version before the data so a concurrent commit can only
+        # cause an extra refresh, never a missed one
+        version = self.connections.data_version()
+        
+        with self._lock:
+            if self._frame is None:
+                self._cold_start()
+            elif version != self._version:
+                self._refresh()
+            self._version = version
+            
+            self._maybe_write_snapshot()
+            
+            # Shallow copy: shares the column data, but adding or replacing
+            # columns on the result does not touch the cached frame
+            return self._frame.copy(deep=False)
+    
+    def invalidate(self):
+        """Drop the cached table so the next request reloads it"""
+        with self._lock:
+            self._frame = None
+            self._version = None
+            self._token = None
+            self._database_id = None
+    
+    def _cold_start(self):
+        """Start from the on-disk snapshot when possible, else read the table"""
+        with self.connections.reader() as conn:
+            database_id = change_log.database_id(conn)
+        
+        snapshot = self._read_snapshot(database_id)
+        if snapshot is None:
+            self._load()
+            return
+        
+        # Bring a stale snapshot up to date through the change log
+        self._frame, self._token = snapshot
+        self._database_id = database_id
+        self._snapshot_token = self._token
+        self._refresh()
+    
+    def _read_snapshot(self, database_id):
+        """Memory-map the snapshot columns, returning (frame, token) or None.
+        
+        A snapshot written for another database, e.g. before the file was
+        replaced or restored, is never used: its token means nothing here.
+        """
+        try:
+            with open(os.path.join(self.snapshot_dir, 'meta.json')) as f:
+                meta = json.load(f)
+            if meta.get('format') != self.SNAPSHOT_FORMAT:
+                return None
+            if database_id is None or meta.get('database_id') != database_id:
+                return None
+            
+            columns = {
+                name: np.load(os.path.join(self.snapshot_dir, f'{name}.npy'), mmap_mode='r')
+                for name in self.COLUMNS
+            }
+        except (OSError, ValueError, KeyError):
+            return None
+        
+        if any(len(column) != meta['rows'] for column in columns.values()):
+            return None
+        
+        return pd.DataFrame(columns, copy=False), meta['token']
+    
+    def _maybe_write_snapshot(self):
+        """Rewrite the snapshot in the background when it has fallen behind"""
+        if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+            return
+        
+        # Until the database has its id the snapshot could not be verified
+        if self._database_id is None:
+            return
+        
+        if self._snapshot_token is not None:
+            lag = self._token - self._snapshot_token
+            if 0 <= lag < self.SNAPSHOT_MIN_CHANGES:
+                return
+        
+        frame, token = self._frame, self._token
+        self._snapshot_token = token
+        self._snapshot_thread = threading.Thread(
+            target=self._write_snapshot, args=(frame, token, self._database_id), daemon=True
+        )
+        self._snapshot_thread.start()
+    
+    def _write_snapshot(self, frame, token, database_id):
+        """Save the columns and stamp them with the database id and change token"""
+        meta_path = os.path.join(self.snapshot_dir, 'meta.json')
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            
+            # Invalidate first so a crash mid-write never leaves a bad stamp
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            
+            for name in self.COLUMNS:
+                path = os.path.join(self.snapshot_dir, f'{name}.npy')
+                with open(path + '.tmp', 'wb') as f:
+                    np.save(f, frame[name].to_numpy())
+                os.replace(path + '.tmp', path)
+            
+            with open(meta_path + '.tmp', 'w') as f:
+                json.dump({'format': self.SNAPSHOT_FORMAT, 'database_id': database_id,
+                           'token': token, 'rows': len(frame)}, f)
+            os.replace(meta_path + '.tmp', meta_path)
+            
+        except OSError:
+            # The snapshot is only an accelerator; the next load rebuilds it
+            self._snapshot_token = None
+    
+    def _load(self):
+        """Read the whole table into preallocated typed columns"""
+        with self.connections.reader() as conn:
+            # Token, sizes and rows all come from the same snapshot
+            conn.execute("BEGIN")
+            token = change_log.current_token(conn)
+            database_id = change_log.database_id(conn)
+            count, min_id, max_id, min_pop, max_pop = conn.execute('''
+                SELECT COUNT(*), MIN(id), MAX(id), MIN(population), MAX(population)
+                FROM crab_population
+            ''').fetchone()
+            
+            ids = np.empty(count, dtype=integer_dtype(min_id, max_id))
+            populations = np.empty(count, dtype=integer_dtype(min_pop, max_pop))
+            latitudes = np.empty(count, dtype=np.float64)
+            longitudes = np.empty(count, dtype=np.float64)
+            seconds = np.empty(count, dtype=np.int64)
+            
+            cursor = conn.execute(f'''
+                SELECT id, population, latitude, longitude,
+                       COALESCE(CAST(strftime('%s', date_added) AS INTEGER), {NAT_SECONDS})
+                FROM crab_population
+            ''')
+            
+            filled = 0
+            while True:
+                rows = cursor.fetchmany(self.FETCH_BATCH)
+                if not rows:
+                    break
+                
+                end = filled + len(rows)
+                columns = list(zip(*rows))
+                ids[filled:end] = columns[0]
+                populations[filled:end] = columns[1]
+                latitudes[filled:end] = columns[2]
+                longitudes[filled:end] = columns[3]
+                seconds[filled:end] = columns[4]
+                filled = end
+        
+        self._frame = pd.DataFrame({
+            'id': ids[:filled],
+            'population': populations[:filled],
+            'latitude': latitudes[:filled],
+            'longitude': longitudes[:filled],
+            'date_added': seconds[:filled].view('datetime64[s]')
+        }, copy=False)
+        self._token = token
+        self._database_id = database_id
+    
+    def _refresh(self):
+        """Apply the change log since the last refresh to the cached table"""
+        with self.connections.reader() as conn:
+            changes = change_log.read_changes(conn, self._token)
+            # The id appears once the migration that adds it has run
+            if self._database_id is None:
+                self._database_id = change_log.database_id(conn)
+        
+        touched = len(changes['inserted']) + len(changes['updated']) + len(changes['deleted'])
+        if changes['reset'] or touched > len(self._frame) * self.MAX_DELTA_FRACTION:
+            self._load()
+            return
+        
+        if touched:
+            stale_ids = set(changes['deleted']).union(changes['updated']['id'])
+            kept = self._frame[~self._frame['id'].isin(stale_ids)]
+            parts = [kept] + [compact_frame(part) for part in (changes['updated'], changes['inserted'])
+                              if not part.empty]
+            frame = pd.concat(parts, ignore_index=True)
+            
+            # Widen the integer columns only if the new rows need it
+            self._frame = frame.astype({
+                'id': integer_dtype(frame['id'].min(), frame['id'].max()),
+                'population': integer_dtype(frame['population'].min(), frame['population'].max())
+            }) if len(frame) else frame
+        
+        self._token = changes['token']
@@ -1,11 +1,346 @@
 import os
+import queue
+import re
 import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import pandas as pd
 from PyQt5.QtCore import QObject, pyqtSignal
 
+import change_log
+from csv_importer import CsvImporter
+from data_store import CrabDataStore, compact_frame
+from migrations import Migration, MigrationRunner, backfill_limit
+from partitions import (ARCHIVED_ID_SCHEMA, ARCHIVED_ID_TABLE, PARTITION_SCHEMA, PARTITION_TABLE,
+                        PartitionError, PartitionManager, format_timestamp)
+
+class QueryCache:
+    """Bounded LRU cache of query results keyed by SQL text and parameters.
+    
+    Entries are only valid for the data version they were read at; the
+    whole cache is dropped as soon as the version moves.
+    """
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def make_key(sql, params):
+        """Normalize whitespace so formatting differences share an entry"""
+        return re.sub(r"\s+", " ", sql).strip(), tuple(params or ())
+    
+    def get(self, key, version):
+        """Return (True, value) on a hit or (False, None) on a miss"""
+        with self._lock:
+            if version != self._version:
+                self._clear()
+                self._version = version
+            
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+    
+    def put(self, key, value, version):
+        """Store a result read at the given data version"""
+        size = self._estimate_size(value)
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            # Results read before a newer write must not be cached
+            if version != self._version:
+                return
+            
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            
+            self._entries[key] = (value, size)
+            self._bytes += size
+            
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._clear()
+    
+    def stats(self):
+        """Return hit/miss/eviction counters and current usage"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
+    
+    def _clear(self):
+        self._entries.clear()
+        self._bytes = 0
+    
+    def _estimate_size(self, value):
+        """Rough size of a cached result in bytes"""
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(index=True, deep=True).sum())
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(
+                sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items()
+            )
+        if isinstance(value, (list, tuple)):
+            return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+        return sys.getsizeof(value)
+
+class ConnectionManager:
+    """Process-wide pool of SQLite connections for a single database file.
+
+    Reads are served from a small pool of reader connections; all writes go
+    through one serialized writer connection. The database runs in WAL mode
+    so readers never block on the writer (and vice versa).
+    """
+    # Room for every query executor thread plus the GUI, migration,
+    # maintenance and snapshot threads, some of which hold a reader for a
+    # whole table read
+    READER_POOL_SIZE = 8
+    BUSY_TIMEOUT_MS = 5000
+    CACHE_SIZE_KB = 32768
+    MMAP_SIZE = 256 * 1024 * 1024
+    
+    _instances = {}
+    _instances_lock = threading.Lock()
+    
+    @classmethod
+    def for_path(cls, db_path):
+        """Return the shared connection manager for a database path"""
+        key = os.path.abspath(db_path)
+        with cls._instances_lock:
+            manager = cls._instances.get(key)
+            if manager is None:
+                manager = cls(key)
+                cls._instances[key] = manager
+            return manager
+    
+    @classmethod
+    def close_all(cls):
+        """Close every pooled connection in the process"""
+        with cls._instances_lock:
+            for manager in cls._instances.values():
+                manager.close()
+            cls._instances.clear()
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.initialized = False
+        self.has_rtree = False
+        self.init_lock = threading.Lock()
+        
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        
+        self._writer = None
+        self._writer_depth = 0
+        self._writer_lock = threading.RLock()
+        self.write_count = 0
+        
+        self.query_cache = QueryCache()
+        
+        self._probe = None
+        self._probe_lock = threading.Lock()
+    
+    def _connect(self):
+        """Open a connection with the shared pragma policy applied"""
+        # uri=True lets the connection ATTACH read-only partition URIs
+        conn = sqlite3.connect(self.db_path, timeout=self.BUSY_TIMEOUT_MS / 1000,
+                               isolation_level=None, check_same_thread=False, uri=True)
+        
+        # Only takes effect on a new database or at the next full VACUUM
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {self.BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size = -{self.CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {self.MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+    
+    @contextmanager
+    def reader(self):
+        """Borrow a pooled read connection.
+        
+        Raises sqlite3.OperationalError when every reader stays busy for the
+        busy timeout, like _writer_held.
+        """
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._reader_lock:
+                create = self._reader_count < self.READER_POOL_SIZE
+                if create:
+                    self._reader_count += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except sqlite3.Error:
+                    with self._reader_lock:
+                        self._reader_count -= 1
+                    raise
+            else:
+                try:
+                    conn = self._readers.get(timeout=self.BUSY_TIMEOUT_MS / 1000)
+                except queue.Empty:
+                    raise sqlite3.OperationalError("database is locked") from None
+        
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+    
+    @contextmanager
+    def _writer_held(self):
+        """Take the writer lock under the same busy timeout as SQLite itself.
+        
+        Raises sqlite3.OperationalError like a locked database would, so a
+        write made while a long import or VACUUM holds the writer fails
+        through the caller's error path instead of stalling.
+        """
+        if not self._writer_lock.acquire(timeout=self.BUSY_TIMEOUT_MS / 1000):
+            raise sqlite3.OperationalError("database is locked")
+        try:
+            if self._writer is None:
+                self._writer = self._connect()
+            yield self._writer
+        finally:
+            self._writer_lock.release()
+    
+    @contextmanager
+    def writer(self):
+        """Hold the writer connection inside a single IMMEDIATE transaction.
+        
+        Nested use from the same thread joins the outer transaction. Only a
+        transaction that changed rows counts as a write for cache_version().
+        """
+        with self._writer_held() as conn:
+            outermost = self._writer_depth == 0
+            if outermost:
+                changes_before = conn.total_changes
+                conn.execute("BEGIN IMMEDIATE")
+            self._writer_depth += 1
+            try:
+                yield conn
+            except BaseException:
+                self._writer_depth -= 1
+                if outermost and conn.in_transaction:
+                    conn.rollback()
+                raise
+            else:
+                self._writer_depth -= 1
+                if outermost and conn.in_transaction:
+                    conn.commit()
+                    if conn.total_changes != changes_before:
+                        self.write_count += 1
+    
+    @contextmanager
+    def autocommit_writer(self):
+        """Hold the writer connection outside of any transaction.
+        
+        For statements that cannot run inside one, such as VACUUM or a
+        WAL checkpoint; other writers wait until the block is done.
+        """
+        with self._writer_held() as conn:
+            if self._writer_depth:
+                raise sqlite3.OperationalError("The writer is inside a transaction")
+            yield conn
+    
+    def data_version(self):
+        """Return a token that changes whenever any connection commits.
+        
+        Uses a dedicated connection that never writes, so its
+        PRAGMA data_version moves on every commit made elsewhere,
+        including our own writer and other processes.
+        """
+        with self._probe_lock:
+            if self._probe is None:
+                self._probe = self._connect()
+            return self._probe.execute("PRAGMA data_version").fetchone()[0]
+    
+    def cache_version(self):
+        """Version token for cached query results.
+        
+        Combines our own write counter with data_version so commits from
+        other processes also invalidate the cache.
+        """
+        return self.write_count, self.data_version()
+    
+    def close(self):
+        """Close the writer and all idle reader connections"""
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        
+        with self._probe_lock:
+            if self._probe is not None:
+                self._probe.close()
+                self._probe = None
+        
+        while True:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._reader_lock:
+                self._reader_count -= 1
+
 class DatabaseManager(QObject):
     error_occurred = pyqtSignal(str)
     
+    # Rollup granularity -> (table, SQL bucket expression, period format)
+    ROLLUPS = {
+        'day': ('crab_population_daily', "date({})", '%Y-%m-%d'),
+        'month': ('crab_population_monthly', "strftime('%Y-%m', {})", '%Y-%m')
+    }
+    
+    # Rows with a higher id are still to be added to the summary and the
+    # rollups by the base schema backfill, so the triggers skip them
+    SEEDED_ID = backfill_limit(1)
+    
+    # Change log entries kept at startup; older tokens get a full reload
+    CHANGE_LOG_RETENTION = 100000
+    
+    # Survey points within ~1 m of each other (5 decimals) share a site
+    SITE_COORDINATE_DIGITS = 5
+    
+    # Deletes of more rows than this apply the delete triggers set-based
+    BULK_DELETE_ROWS = 1000
+    
+    # Grid cell keys kept for every survey point, as decimal digits of the
+    # cell size in degrees: 0.1 (~11 km), 0.01 (~1.1 km) and 0.001 (~110 m)
+    CELL_RESOLUTIONS = (1, 2, 3)
+    
     def __init__(self, db_path='data/blue_crab.db'):
         super().__init__()
         
@@ -13,122 +348,1087 @@ class DatabaseManager(QObject):
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         
         self.db_path = db_path
-        self.initialize_db()
+        self.connections = ConnectionManager.for_path(db_path)
+        self.data_store = CrabDataStore.for_connections(self.connections)
+        self.partitions = PartitionManager(
+            self.connections, [(table, bucket) for table, bucket, _ in self.ROLLUPS.values()]
+        )
+        
+        # Schema setup only needs to run once per process for each database
+        with self.connections.init_lock:
+            if not self.connections.initialized:
+                self.connections.initialized = self.initialize_db()
     
     def initialize_db(self):
-        """Create database and tables if they don't exist"""
+        """Create or upgrade the schema and prepare the connections"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            # Backfills run on in the background; the schema is in place now
+            self.migration_runner = MigrationRunner(self.connections, self.migrations(),
+                                                    error_callback=self.error_occurred.emit)
+            self.migration_runner.run(background=True)
             
-            # Create crab_population table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS crab_population (
-                    id INTEGER PRIMARY KEY,
-                    population INTEGER NOT NULL,
-                    latitude REAL NOT NULL,
-                    longitude REAL NOT NULL,
-                    date_added TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            with self.connections.writer() as conn:
+                self.connections.has_rtree = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'crab_population_rtree'"
+                ).fetchone() is not None
+                change_log.prune_changes(conn, keep=self.CHANGE_LOG_RETENTION)
             
-            # Create settings table
+            return True
+            
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Database initialization error: {str(e)}")
+            return False
+    
+    def migrated(self, version=None):
+        """Whether a migration, by default the latest, has been fully applied"""
+        if version is None:
+            version = self.migrations()[-1].version
+        with self.connections.reader() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0] >= version
+    
+    def migrations(self):
+        """Every schema version in order; append new ones, never renumber"""
+        return [
+            Migration(1, 'base schema', self._create_base_schema,
+                      backfill_table='crab_population', backfill=self._backfill_base_schema),
+            Migration(2, 'sites and observations', self._create_observation_tables,
+                      backfill_table='crab_population', backfill=self._backfill_observations),
+            Migration(3, 'grid cell keys', self._create_cell_columns),
+            Migration(4, 'archived ids', self._create_archived_id_table,
+                      backfill_table=PARTITION_TABLE, backfill=self.partitions.backfill_archived_ids),
+            Migration(5, 'survey indexes', self._create_survey_indexes),
+            Migration(6, 'database id', self._create_database_id)
+        ]
+    
+    def _create_base_schema(self, cursor):
+        """Create the survey table, its derived tables and the settings.
+        
+        Only tables and triggers are created here; existing rows reach the
+        derived tables through _backfill_base_schema.
+        """
+        # Create crab_population table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS crab_population (
+                id INTEGER PRIMARY KEY,
+                population INTEGER NOT NULL,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                date_added TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Spatial index over survey points
+        self._create_spatial_index(cursor)
+        
+        # Change log for incremental consumers
+        for statement in change_log.CHANGE_LOG_SCHEMA:
+            cursor.execute(statement)
+        
+        # Running totals for the dashboard KPIs
+        self._create_summary_table(cursor)
+        
+        # Per-day and per-month totals for the trend charts
+        self._create_rollup_tables(cursor)
+        
+        # Registry of archived seasons
+        for statement in PARTITION_SCHEMA:
+            cursor.execute(statement)
+        
+        # Create settings table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
+        
+        # Insert default settings if not exist
+        default_settings = [
+            ('theme', 'dark'),
+            ('map_style', 'dark'),
+            ('default_view', 'dashboard')
+        ]
+        
+        cursor.executemany('''
+            INSERT OR IGNORE INTO settings (key, value)
+            VALUES (?, ?)
+        ''', default_settings)
+    
+    def _create_spatial_index(self, cursor):
+        """Create the R*Tree index and its sync triggers.
+        
+        Returns False when this SQLite build has no R*Tree module, in which
+        case _create_survey_indexes adds a plain (latitude, longitude) index.
+        """
+        try:
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL
+                CREATE VIRTUAL TABLE IF NOT EXISTS crab_population_rtree USING rtree(
+                    id, min_lat, max_lat, min_lon, max_lon
                 )
             ''')
+        except sqlite3.OperationalError:
+            return False
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS crab_population_rtree_insert
+            AFTER INSERT ON crab_population
+            BEGIN
+                INSERT OR REPLACE INTO crab_population_rtree
+                VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS crab_population_rtree_update
+            AFTER UPDATE OF id, latitude, longitude ON crab_population
+            BEGIN
+                DELETE FROM crab_population_rtree WHERE id = OLD.id;
+                INSERT OR REPLACE INTO crab_population_rtree
+                VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS crab_population_rtree_delete
+            AFTER DELETE ON crab_population
+            BEGIN
+                DELETE FROM crab_population_rtree WHERE id = OLD.id;
+            END
+        ''')
+        
+        return True
+    
+    def _create_summary_table(self, cursor):
+        """Create the single-row summary table and the triggers that maintain it"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS crab_population_summary (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                row_count INTEGER NOT NULL,
+                population_sum INTEGER NOT NULL,
+                population_sum_sq REAL NOT NULL,
+                population_max INTEGER
+            )
+        ''')
+        cursor.execute('''
+            INSERT OR IGNORE INTO crab_population_summary
+                (id, row_count, population_sum, population_sum_sq, population_max)
+            VALUES (1, 0, 0, 0, NULL)
+        ''')
+        
+        seeded = self.SEEDED_ID
+        new_maximum = f"(SELECT MAX(population) FROM crab_population WHERE id <= {seeded})"
+        
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS crab_population_summary_insert
+            AFTER INSERT ON crab_population
+            BEGIN
+                UPDATE crab_population_summary SET
+                    row_count = row_count + 1,
+                    population_sum = population_sum + NEW.population,
+                    population_sum_sq = population_sum_sq + 1.0 * NEW.population * NEW.population,
+                    population_max = MAX(COALESCE(population_max, NEW.population), NEW.population)
+                WHERE id = 1 AND NEW.id <= {seeded};
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS crab_population_summary_update
+            AFTER UPDATE OF population ON crab_population
+            BEGIN
+                UPDATE crab_population_summary SET
+                    population_sum = population_sum - OLD.population + NEW.population,
+                    population_sum_sq = population_sum_sq
+                        - 1.0 * OLD.population * OLD.population
+                        + 1.0 * NEW.population * NEW.population,
+                    population_max = CASE
+                        WHEN NEW.population >= population_max THEN NEW.population
+                        WHEN OLD.population >= population_max THEN {new_maximum}
+                        ELSE population_max
+                    END
+                WHERE id = 1 AND OLD.id <= {seeded};
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS crab_population_summary_delete
+            AFTER DELETE ON crab_population
+            BEGIN
+                UPDATE crab_population_summary SET
+                    row_count = row_count - 1,
+                    population_sum = population_sum - OLD.population,
+                    population_sum_sq = population_sum_sq - 1.0 * OLD.population * OLD.population,
+                    population_max = CASE
+                        WHEN OLD.population >= population_max THEN {new_maximum}
+                        ELSE population_max
+                    END
+                WHERE id = 1 AND OLD.id <= {seeded};
+            END
+        ''')
+    
+    def _create_rollup_tables(self, cursor):
+        """Create the day/month rollup tables and the triggers that maintain them"""
+        seeded = self.SEEDED_ID
+        for table, bucket, _ in self.ROLLUPS.values():
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    period TEXT PRIMARY KEY,
+                    row_count INTEGER NOT NULL,
+                    population_sum INTEGER NOT NULL
+                ) WITHOUT ROWID
+            ''')
             
-            # Insert default settings if not exist
-            default_settings = [
-                ('theme', 'dark'),
-                ('map_style', 'dark'),
-                ('default_view', 'dashboard')
-            ]
+            new_period = bucket.format("NEW.date_added")
+            old_period = bucket.format("OLD.date_added")
+            add_new = f'''
+                INSERT INTO {table} (period, row_count, population_sum)
+                SELECT {new_period}, 1, NEW.population
+                WHERE {new_period} IS NOT NULL AND NEW.id <= {seeded}
+                ON CONFLICT (period) DO UPDATE SET
+                    row_count = row_count + 1,
+                    population_sum = population_sum + excluded.population_sum;
+            '''
+            remove_old = f'''
+                UPDATE {table} SET
+                    row_count = row_count - 1,
+                    population_sum = population_sum - OLD.population
+                WHERE period = {old_period} AND OLD.id <= {seeded};
+                DELETE FROM {table} WHERE period = {old_period} AND row_count <= 0;
+            '''
             
-            for key, value in default_settings:
-                cursor.execute('''
-                    INSERT OR IGNORE INTO settings (key, value)
-                    VALUES (?, ?)
-                ''', (key, value))
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_insert
+                AFTER INSERT ON crab_population
+                BEGIN {add_new} END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_update
+                AFTER UPDATE OF population, date_added ON crab_population
+                BEGIN {remove_old} {add_new} END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_delete
+                AFTER DELETE ON crab_population
+                BEGIN {remove_old} END
+            ''')
+    
+    def _site_key(self, table=None):
+        """SQL for the rounded (latitude, longitude) that identifies a site"""
+        prefix = f"{table}." if table else ""
+        digits = self.SITE_COORDINATE_DIGITS
+        return f"round({prefix}latitude, {digits})", f"round({prefix}longitude, {digits})"
+    
+    def _create_observation_tables(self, cursor):
+        """Create the sites and observations tables and the triggers that fill them.
+        
+        Every crab_population row is mirrored as one observation of the site
+        at its coordinates, linked through source_id. observed_at starts out
+        as date_added and is replaced by the survey date when an import has
+        one.
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sites (
+                site_id INTEGER PRIMARY KEY,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                UNIQUE (latitude, longitude)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS observations (
+                observation_id INTEGER PRIMARY KEY,
+                site_id INTEGER NOT NULL REFERENCES sites (site_id),
+                observed_at TEXT NOT NULL,
+                population INTEGER NOT NULL,
+                source_id INTEGER UNIQUE
+            )
+        ''')
+        
+        # Per-site history is a range scan of this index; population is
+        # included so the scan never has to visit the table
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_observations_site_time
+            ON observations (site_id, observed_at, population)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_observations_time
+            ON observations (observed_at)
+        ''')
+        
+        new_lat, new_lon = self._site_key("NEW")
+        new_site = f"SELECT site_id FROM sites WHERE latitude = {new_lat} AND longitude = {new_lon}"
+        
+        # Not INSERT OR IGNORE: an upsert on crab_population would override
+        # the trigger's conflict clause and fail on an existing site
+        add_site = f"""
+            INSERT INTO sites (latitude, longitude)
+            SELECT {new_lat}, {new_lon} WHERE NOT EXISTS ({new_site});
+        """
+        
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS observations_insert
+            AFTER INSERT ON crab_population
+            BEGIN
+                {add_site}
+                INSERT INTO observations (site_id, observed_at, population, source_id)
+                VALUES (({new_site}), COALESCE(NEW.date_added, CURRENT_TIMESTAMP), NEW.population, NEW.id);
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS observations_update
+            AFTER UPDATE OF id, population, latitude, longitude, date_added ON crab_population
+            BEGIN
+                {add_site}
+                UPDATE observations SET
+                    site_id = ({new_site}),
+                    observed_at = CASE
+                        WHEN NEW.date_added IS NOT OLD.date_added
+                            THEN COALESCE(NEW.date_added, observed_at)
+                        ELSE observed_at
+                    END,
+                    population = NEW.population,
+                    source_id = NEW.id
+                WHERE source_id = OLD.id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS observations_delete
+            AFTER DELETE ON crab_population
+            BEGIN
+                DELETE FROM observations WHERE source_id = OLD.id;
+            END
+        ''')
+    
+    def _cell_key(self, resolution):
+        """SQL for the grid cell of a point: row-major over the whole globe.
+        
+        Values are offset to be non-negative, so CAST truncation is floor.
+        """
+        scale = 10 ** resolution
+        columns = 360 * scale
+        return (f"CAST((latitude + 90) * {scale} AS INTEGER) * {columns}"
+                f" + MIN(CAST((longitude + 180) * {scale} AS INTEGER), {columns - 1})")
+    
+    def _create_cell_columns(self, cursor):
+        """Add a generated, indexed grid cell key column for each resolution.
+        
+        The columns are VIRTUAL, so rows are never rewritten: the keys are
+        computed on insert and stored only in the indexes, whose creation
+        covers the existing rows.
+        """
+        existing = {row[1] for row in cursor.execute("PRAGMA table_xinfo(crab_population)")}
+        for resolution in self.CELL_RESOLUTIONS:
+            column = f"cell_{resolution}"
+            if column not in existing:
+                cursor.execute(f'''
+                    ALTER TABLE crab_population ADD COLUMN {column} INTEGER
+                    GENERATED ALWAYS AS ({self._cell_key(resolution)}) VIRTUAL
+                ''')
             
-            conn.commit()
-            conn.close()
+            # date_added and population make time-filtered aggregation an
+            # index-only scan
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS idx_crab_population_{column}
+                ON crab_population ({column}, date_added, population)
+            ''')
+    
+    def _create_archived_id_table(self, cursor):
+        """Create the registry of archived IDs and the trigger that checks it"""
+        for statement in ARCHIVED_ID_SCHEMA:
+            cursor.execute(statement)
+    
+    def _create_survey_indexes(self, cursor):
+        """Index crab_population for the summary triggers and date filters"""
+        # Lets the delete/update triggers find a new maximum without a scan
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_crab_population_population
+            ON crab_population (population)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_crab_population_date_added
+            ON crab_population (date_added)
+        ''')
+        
+        # Bounding-box queries fall back to this without the R*Tree module
+        has_rtree = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'crab_population_rtree'"
+        ).fetchone() is not None
+        if not has_rtree:
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_crab_population_lat_lon
+                ON crab_population (latitude, longitude)
+            ''')
+    
+    def _create_database_id(self, cursor):
+        """Stamp the database with the id that on-disk caches are checked against"""
+        for statement in change_log.DATABASE_ID_SCHEMA:
+            cursor.execute(statement)
+    
+    def _insert_observations(self, conn, rows, params=()):
+        """Add sites and observations for the crab_population rows selected by rows.
+        
+        Returns the number of observations added.
+        """
+        lat, lon = self._site_key()
+        conn.execute(f'''
+            INSERT OR IGNORE INTO sites (latitude, longitude)
+            SELECT {lat}, {lon} FROM ({rows})
+        ''', params)
+        
+        lat, lon = self._site_key("c")
+        return conn.execute(f'''
+            INSERT OR IGNORE INTO observations (site_id, observed_at, population, source_id)
+            SELECT s.site_id, COALESCE(c.date_added, CURRENT_TIMESTAMP), c.population, c.id
+            FROM ({rows}) c
+            JOIN sites s ON s.latitude = {lat} AND s.longitude = {lon}
+        ''', params).rowcount
+    
+    def _backfill_base_schema(self, conn, low, high):
+        """Add crab_population rows with low < id <= high to the derived tables"""
+        rows = "SELECT * FROM crab_population WHERE id > ? AND id <= ?"
+        has_rtree = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'crab_population_rtree'"
+        ).fetchone() is not None
+        if has_rtree:
+            conn.execute(f'''
+                INSERT OR REPLACE INTO crab_population_rtree
+                SELECT id, latitude, latitude, longitude, longitude FROM ({rows})
+            ''', (low, high))
+        
+        self._add_to_totals(conn, rows, (low, high))
+        return conn.execute(f"SELECT COUNT(*) FROM ({rows})", (low, high)).fetchone()[0]
+    
+    def _add_to_totals(self, conn, rows, params=()):
+        """Add the crab_population rows selected by rows to the summary and rollups"""
+        conn.execute(f'''
+            UPDATE crab_population_summary SET
+                row_count = row_count + s.n,
+                population_sum = population_sum + s.total,
+                population_sum_sq = population_sum_sq + s.total_sq,
+                population_max = MAX(COALESCE(population_max, s.maximum),
+                                     COALESCE(s.maximum, population_max))
+            FROM (
+                SELECT COUNT(*) AS n, COALESCE(SUM(population), 0) AS total,
+                       COALESCE(SUM(1.0 * population * population), 0) AS total_sq,
+                       MAX(population) AS maximum
+                FROM ({rows})
+            ) s
+            WHERE id = 1
+        ''', params)
+        
+        for table, bucket, _ in self.ROLLUPS.values():
+            period = bucket.format("date_added")
+            conn.execute(f'''
+                INSERT INTO {table} (period, row_count, population_sum)
+                SELECT {period}, COUNT(*), SUM(population)
+                FROM ({rows})
+                WHERE {period} IS NOT NULL
+                GROUP BY 1
+                ON CONFLICT (period) DO UPDATE SET
+                    row_count = row_count + excluded.row_count,
+                    population_sum = population_sum + excluded.population_sum
+            ''', params)
+    
+    def _backfill_observations(self, conn, low, high):
+        """Add the observations of crab_population rows with low < id <= high"""
+        return self._insert_observations(
+            conn, "SELECT * FROM crab_population WHERE id > ? AND id <= ?", (low, high)
+        )
+    
+    def sync_inserted_rows(self, conn, id_table):
+        """Apply the crab_population insert triggers in bulk.
+        
+        Used by large imports that load with the triggers dropped: every
+        derived structure maintained by an insert trigger gets the same
+        update here, set-based, for the rows whose ids are in id_table, and
+        archived IDs are rejected as the archived ID trigger would.
+        """
+        rows = f"SELECT * FROM crab_population WHERE id IN (SELECT id FROM {id_table})"
+        
+        archived = conn.execute(f'''
+            SELECT i.id FROM {id_table} i JOIN {ARCHIVED_ID_TABLE} a ON a.id = i.id LIMIT 1
+        ''').fetchone()
+        if archived is not None:
+            raise sqlite3.IntegrityError(f"ID {archived[0]} belongs to an archived season")
+        
+        if self.connections.has_rtree:
+            conn.execute(f'''
+                INSERT OR REPLACE INTO crab_population_rtree
+                SELECT id, latitude, latitude, longitude, longitude FROM ({rows})
+            ''')
+        
+        conn.execute(f'''
+            INSERT INTO {change_log.CHANGE_LOG_TABLE} (row_id, op)
+            SELECT id, 'I' FROM {id_table} ORDER BY id
+        ''')
+        
+        self._add_to_totals(conn, f"{rows} AND id <= {self.SEEDED_ID}")
+        self._insert_observations(conn, rows)
+    
+    def sync_deleted_rows(self, conn, row_table):
+        """Apply the crab_population delete triggers in bulk.
+        
+        The counterpart of sync_inserted_rows for large deletes made with
+        the delete triggers dropped; row_table holds the deleted rows.
+        """
+        if self.connections.has_rtree:
+            conn.execute(f"DELETE FROM crab_population_rtree WHERE id IN (SELECT id FROM {row_table})")
+        
+        conn.execute(f'''
+            INSERT INTO {change_log.CHANGE_LOG_TABLE} (row_id, op)
+            SELECT id, 'D' FROM {row_table} ORDER BY id
+        ''')
+        
+        seeded = self.SEEDED_ID
+        
+        conn.execute(f'''
+            UPDATE crab_population_summary SET
+                row_count = row_count - s.n,
+                population_sum = population_sum - s.total,
+                population_sum_sq = population_sum_sq - s.total_sq,
+                population_max = CASE
+                    WHEN s.maximum >= population_max
+                        THEN (SELECT MAX(population) FROM crab_population WHERE id <= {seeded})
+                    ELSE population_max
+                END
+            FROM (
+                SELECT COUNT(*) AS n, COALESCE(SUM(population), 0) AS total,
+                       COALESCE(SUM(1.0 * population * population), 0) AS total_sq,
+                       MAX(population) AS maximum
+                FROM {row_table}
+                WHERE id <= {seeded}
+            ) s
+            WHERE id = 1
+        ''')
+        
+        conn.execute(f"DELETE FROM observations WHERE source_id IN (SELECT id FROM {row_table})")
+        
+        for table, bucket, _ in self.ROLLUPS.values():
+            period = bucket.format("date_added")
+            conn.execute(f'''
+                UPDATE {table} SET
+                    row_count = {table}.row_count - d.row_count,
+                    population_sum = {table}.population_sum - d.population_sum
+                FROM (
+                    SELECT {period} AS period, COUNT(*) AS row_count,
+                           SUM(population) AS population_sum
+                    FROM {row_table}
+                    WHERE {period} IS NOT NULL AND id <= {seeded}
+                    GROUP BY 1
+                ) d
+                WHERE {table}.period = d.period
+            ''')
+            conn.execute(f"DELETE FROM {table} WHERE row_count <= 0")
+    
+    def _bbox_query(self, select, min_lat, min_lon, max_lat, max_lon):
+        """Build a bounding-box query over crab_population and its parameters"""
+        # The R*Tree stores 32-bit floats rounded outwards, so it narrows the
+        # candidates and the exact comparison on the base table decides
+        exact = "c.latitude BETWEEN ? AND ? AND c.longitude BETWEEN ? AND ?"
+        params = [min_lat, max_lat, min_lon, max_lon]
+        
+        if self.connections.has_rtree:
+            query = f'''
+                SELECT {select}
+                FROM crab_population_rtree r
+                JOIN crab_population c ON c.id = r.id
+                WHERE r.max_lat >= ? AND r.min_lat <= ?
+                  AND r.max_lon >= ? AND r.min_lon <= ?
+                  AND {exact}
+            '''
+            return query, [min_lat, max_lat, min_lon, max_lon] + params
+        
+        return f"SELECT {select} FROM crab_population c WHERE {exact}", params
+    
+    def _cached_query(self, query, params=(), fetch='frame', attach=()):
+        """Run a read query through the shared LRU result cache.
+        
+        fetch is 'frame' for a DataFrame, 'one' for fetchone() or 'all' for
+        fetchall(). attach names the partitions the query reads from.
+        DataFrames come back as shallow copies so callers can add columns,
+        but must not modify values in place.
+        """
+        cache = self.connections.query_cache
+        key = (fetch,) + QueryCache.make_key(query, params)
+        version = self.connections.cache_version()
+        
+        hit, value = cache.get(key, version)
+        if not hit:
+            with self.connections.reader() as conn:
+                if attach:
+                    self.partitions.attach(conn, attach)
+                if fetch == 'frame':
+                    value = self._read_frame(conn, query, params)
+                elif fetch == 'one':
+                    value = conn.execute(query, params).fetchone()
+                else:
+                    value = conn.execute(query, params).fetchall()
+            cache.put(key, value, version)
+        
+        if isinstance(value, pd.DataFrame):
+            return value.copy(deep=False)
+        return value
+    
+    def _read_frame(self, conn, query, params=()):
+        """pd.read_sql_query, raising the sqlite3 error when the query fails.
+        
+        pandas wraps driver errors in its own DatabaseError, which the
+        except sqlite3.Error handlers of the read methods would miss.
+        """
+        try:
+            return pd.read_sql_query(query, conn, params=params)
+        except pd.errors.DatabaseError as e:
+            if isinstance(e.__cause__, sqlite3.Error):
+                raise e.__cause__
+            raise sqlite3.DatabaseError(str(e)) from e
+    
+    def cache_stats(self):
+        """Get hit/miss/eviction counters of the query result cache"""
+        return self.connections.query_cache.stats()
+    
+    def get_crab_data_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Get crab population data inside a latitude/longitude bounding box"""
+        try:
+            select = "c.id, c.population, c.latitude, c.longitude, c.date_added"
+            query, params = self._bbox_query(select, min_lat, min_lon, max_lat, max_lon)
+            return compact_frame(self._cached_query(query, params))
             
         except sqlite3.Error as e:
-            self.error_occurred.emit(f"Database initialization error: {str(e)}")
+            self.error_occurred.emit(f"Error retrieving data: {str(e)}")
+            return pd.DataFrame()
+    
+    def count_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Count survey points inside a latitude/longitude bounding box"""
+        try:
+            query, params = self._bbox_query("COUNT(*)", min_lat, min_lon, max_lat, max_lon)
+            return self._cached_query(query, params, fetch='one')[0]
+            
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error counting data: {str(e)}")
+            return 0
     
     def insert_crab_data(self, crab_id, population, latitude, longitude):
         """Insert a single crab population data point"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self.connections.writer() as conn:
+                conn.execute('''
+                    INSERT INTO crab_population (id, population, latitude, longitude)
+                    VALUES (?, ?, ?, ?)
+                ''', (crab_id, population, latitude, longitude))
             
-            cursor.execute('''
-                INSERT INTO crab_population (id, population, latitude, longitude)
-                VALUES (?, ?, ?, ?)
-            ''', (crab_id, population, latitude, longitude))
-            
-            conn.commit()
-            conn.close()
             return True
             
         except sqlite3.Error as e:
             self.error_occurred.emit(f"Error inserting data: {str(e)}")
             return False
     
-    def import_csv(self, csv_path):
+    def import_csv(self, csv_path, mode='append'):
         """Import data from CSV file"""
+        importer = CsvImporter(self, csv_path, mode=mode)
+        if importer.run():
+            return True
+        
+        self.error_occurred.emit(importer.message)
+        return False
+    
+    def merge_csv(self, csv_path):
+        """Insert or update rows from a CSV file keyed on ID.
+        
+        Returns a dict of inserted/updated/unchanged counts, or None on failure.
+        """
+        importer = CsvImporter(self, csv_path, mode='merge')
+        if importer.run():
+            return importer.counts
+        
+        self.error_occurred.emit(importer.message)
+        return None
+    
+    def delete_crab_ids(self, ids):
+        """Delete survey points by ID in a single statement.
+        
+        Above BULK_DELETE_ROWS rows the delete triggers are dropped for the
+        statement and their effects applied once by sync_deleted_rows, which
+        needs every migration applied. Returns the number of rows deleted,
+        or None on failure.
+        """
         try:
-            # Read CSV using pandas
-            df = pd.read_csv(csv_path)
+            with self.connections.writer() as conn:
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS delete_ids (id INTEGER PRIMARY KEY)")
+                conn.execute("DELETE FROM temp.delete_ids")
+                conn.executemany("INSERT OR IGNORE INTO temp.delete_ids (id) VALUES (?)",
+                                 ((int(crab_id),) for crab_id in ids))
+                
+                triggers = []
+                count = conn.execute("SELECT COUNT(*) FROM temp.delete_ids").fetchone()[0]
+                if count > self.BULK_DELETE_ROWS and self.migrated():
+                    triggers = conn.execute('''
+                        SELECT name, sql FROM sqlite_master
+                        WHERE type = 'trigger' AND tbl_name = 'crab_population'
+                          AND sql LIKE '%AFTER DELETE ON crab_population%'
+                    ''').fetchall()
+                    for name, _ in triggers:
+                        conn.execute(f'DROP TRIGGER "{name}"')
+                    
+                    # Keep what the triggers would have read from OLD
+                    conn.execute('''
+                        CREATE TEMP TABLE IF NOT EXISTS delete_rows
+                        (id INTEGER PRIMARY KEY, population INTEGER, date_added TEXT)
+                    ''')
+                    conn.execute('''
+                        INSERT INTO temp.delete_rows
+                        SELECT id, population, date_added FROM crab_population
+                        WHERE id IN (SELECT id FROM temp.delete_ids)
+                    ''')
+                
+                cursor = conn.execute(
+                    "DELETE FROM crab_population WHERE id IN (SELECT id FROM temp.delete_ids)"
+                )
+                conn.execute("DELETE FROM temp.delete_ids")
+                
+                if triggers:
+                    self.sync_deleted_rows(conn, 'temp.delete_rows')
+                    conn.execute("DELETE FROM temp.delete_rows")
+                    for _, sql in triggers:
+                        conn.execute(sql)
             
-            # Check required columns
-            required_cols = ['ID', 'Population', 'Latitude', 'Longitude']
-            if not all(col in df.columns for col in required_cols):
-                self.error_occurred.emit("CSV file missing required columns: ID, Population, Latitude, Longitude")
-                return False
+            return cursor.rowcount
             
-            # Connect to database
-            conn = sqlite3.connect(self.db_path)
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error deleting data: {str(e)}")
+            return None
+    
+    def get_all_crab_data(self):
+        """Get all crab population data.
+        
+        Served from the shared in-memory store; treat the result as read-only.
+        """
+        try:
+            return self.data_store.get_frame()
             
-            # Insert data
-            df.to_sql('crab_population', conn, if_exists='append', index=False, 
-                     dtype={
-                         'ID': 'INTEGER',
-                         'Population': 'INTEGER',
-                         'Latitude': 'REAL',
-                         'Longitude': 'REAL'
-                     })
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error retrieving data: {str(e)}")
+            return pd.DataFrame()
+    
+    def get_summary_stats(self, include_archived=True):
+        """Get population totals without scanning.
+        
+        Archived seasons are included unless include_archived is False, in
+        which case the totals match get_all_crab_data.
+        """
+        stats = {
+            'total_population': 0,
+            'total_locations': 0,
+            'average_population': 0.0,
+            'std_population': 0.0,
+            'max_population': 0
+        }
+        
+        try:
+            row = self._cached_query(f'''
+                SELECT s.row_count + COALESCE(p.row_count, 0),
+                       s.population_sum + COALESCE(p.population_sum, 0),
+                       s.population_sum_sq + COALESCE(p.population_sum_sq, 0),
+                       MAX(COALESCE(s.population_max, p.population_max),
+                           COALESCE(p.population_max, s.population_max))
+                FROM crab_population_summary s, (
+                    SELECT SUM(row_count) AS row_count, SUM(population_sum) AS population_sum,
+                           SUM(population_sum_sq) AS population_sum_sq,
+                           MAX(population_max) AS population_max
+                    FROM {PARTITION_TABLE}
+                    WHERE ?
+                ) p
+                WHERE s.id = 1
+            ''', (int(include_archived),), fetch='one')
             
-            conn.close()
-            return True
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error retrieving summary: {str(e)}")
+            return stats
+        
+        if row is None or not row[0]:
+            return stats
+        
+        count, total, total_sq, maximum = row
+        mean = total / count
+        
+        stats['total_population'] = total
+        stats['total_locations'] = count
+        stats['average_population'] = mean
+        stats['std_population'] = max(total_sq / count - mean * mean, 0.0) ** 0.5
+        stats['max_population'] = maximum
+        return stats
+    
+    def get_population_rollup(self, granularity='day', start=None, end=None):
+        """Get total population and survey count per day or month.
+        
+        start and end are inclusive and may be dates, timestamps or strings.
+        Returns a DataFrame with 'period' (datetime), 'population' and 'count'.
+        """
+        if granularity not in self.ROLLUPS:
+            raise ValueError(f"Unknown rollup granularity: {granularity}")
+        
+        table, _, period_format = self.ROLLUPS[granularity]
+        query = f"SELECT period, population_sum AS population, row_count AS count FROM {table}"
+        
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append("period >= ?")
+            params.append(pd.Timestamp(start).strftime(period_format))
+        if end is not None:
+            conditions.append("period <= ?")
+            params.append(pd.Timestamp(end).strftime(period_format))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY period"
+        
+        try:
+            df = self._cached_query(query, params)
             
-        except Exception as e:
-            self.error_occurred.emit(f"Error importing CSV: {str(e)}")
-            return False
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error retrieving rollup: {str(e)}")
+            return pd.DataFrame(columns=['period', 'population', 'count'])
+        
+        df['period'] = pd.to_datetime(df['period'], format=period_format)
+        return df
     
-    def get_all_crab_data(self):
-        """Get all crab population data"""
+    def aggregate_by_cell(self, resolution=2, bbox=None, start=None, end=None, min_population=0):
+        """Get survey count and total population per grid cell.
+        
+        resolution is one of CELL_RESOLUTIONS. bbox is (min_lat, min_lon,
+        max_lat, max_lon); cells overlapping it are aggregated whole. start
+        and end limit date_added to [start, end), and only survey points
+        with at least min_population crabs are counted. Returns a DataFrame
+        with 'cell', 'count', 'population' and the cell centre 'latitude'
+        and 'longitude', from one GROUP BY over the cell index.
+        """
+        if resolution not in self.CELL_RESOLUTIONS:
+            raise ValueError(f"Unknown cell resolution: {resolution}")
+        
+        # Until the grid cell migration has added the indexed column, the
+        # key is computed from the coordinates
+        column = f"cell_{resolution}" if self.migrated(3) else f"({self._cell_key(resolution)})"
+        scale = 10 ** resolution
+        columns = 360 * scale
+        
+        conditions = []
+        params = []
+        if bbox is not None:
+            # Rows of cells between the corners form one key range; the
+            # modulo drops the columns outside the box within that range
+            min_lat, min_lon, max_lat, max_lon = bbox
+            first_row, last_row = (int((lat + 90) * scale) for lat in (min_lat, max_lat))
+            first_col, last_col = (min(int((lon + 180) * scale), columns - 1) for lon in (min_lon, max_lon))
+            conditions.append(f"{column} BETWEEN ? AND ?")
+            conditions.append(f"{column} % {columns} BETWEEN ? AND ?")
+            params += [first_row * columns + first_col, last_row * columns + last_col, first_col, last_col]
+        if start is not None:
+            conditions.append("date_added >= ?")
+            params.append(format_timestamp(start))
+        if end is not None:
+            conditions.append("date_added < ?")
+            params.append(format_timestamp(end))
+        if min_population:
+            conditions.append("population >= ?")
+            params.append(min_population)
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            query = "SELECT id, population, latitude, longitude, date_added FROM crab_population"
-            df = pd.read_sql_query(query, conn)
-            conn.close()
-            return df
+            df = self._cached_query(f'''
+                SELECT {column} AS cell, COUNT(*) AS count, SUM(population) AS population
+                FROM crab_population
+                {where}
+                GROUP BY {column}
+            ''', params)
             
         except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error aggregating cells: {str(e)}")
+            return pd.DataFrame(columns=['cell', 'count', 'population', 'latitude', 'longitude'])
+        
+        df['latitude'] = (df['cell'] // columns + 0.5) / scale - 90
+        df['longitude'] = (df['cell'] % columns + 0.5) / scale - 180
+        return df
+    
+    def get_crab_data_in_range(self, start=None, end=None):
+        """Get survey points dated in [start, end), archived seasons included.
+        
+        Only the partitions overlapping the range are attached and read;
+        leave start or end as None for an open range.
+        """
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append("date_added >= ?")
+            params.append(format_timestamp(start))
+        if end is not None:
+            conditions.append("date_added < ?")
+            params.append(format_timestamp(end))
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        select = "id, population, latitude, longitude, date_added"
+        
+        try:
+            with self.connections.reader() as conn:
+                names = list(self.partitions.list(conn, start, end)['name'])
+                limit = self.partitions.attach_limit(conn)
+            
+            # One query per batch of partitions that fits the ATTACH limit
+            frames = []
+            for offset in range(0, max(len(names), 1), limit):
+                batch = names[offset:offset + limit]
+                query = self.partitions.union_query(batch, select, where, include_live=offset == 0)
+                frames.append(self._cached_query(query, params * (len(batch) + (offset == 0)),
+                                                 attach=batch))
+            
+            return compact_frame(pd.concat(frames, ignore_index=True))
+        
+        except (sqlite3.Error, pd.errors.DatabaseError) as e:
             self.error_occurred.emit(f"Error retrieving data: {str(e)}")
             return pd.DataFrame()
     
+    def get_partitions(self):
+        """Get the registry of archived seasons, oldest first"""
+        try:
+            with self.connections.reader() as conn:
+                return self.partitions.list(conn)
+        
+        except (sqlite3.Error, pd.errors.DatabaseError) as e:
+            self.error_occurred.emit(f"Error retrieving partitions: {str(e)}")
+            return pd.DataFrame()
+    
+    def archive_season(self, year):
+        """Move one calendar year of survey points into its own read-only file.
+        
+        The rows leave the live table, but stay in the summary, the rollups
+        and get_crab_data_in_range, and their IDs cannot be reused. Returns
+        the number of rows archived, or None on failure.
+        """
+        try:
+            # Rows still being backfilled would be taken out of totals they
+            # are not in yet
+            if not self.migrated():
+                raise PartitionError("Database upgrade still running; try again when it has finished")
+            return self.partitions.archive(f'season_{int(year)}', f'{int(year)}-01-01',
+                                           f'{int(year) + 1}-01-01')
+        
+        except (sqlite3.Error, OSError, PartitionError) as e:
+            self.error_occurred.emit(f"Error archiving season {year}: {str(e)}")
+            return None
+    
+    def get_sites(self):
+        """Get every survey site with its number of observations and date range"""
+        try:
+            return self._cached_query('''
+                SELECT s.site_id, s.latitude, s.longitude,
+                       COUNT(o.observed_at) AS observations,
+                       MIN(o.observed_at) AS first_observed,
+                       MAX(o.observed_at) AS last_observed
+                FROM sites s
+                LEFT JOIN observations o ON o.site_id = s.site_id
+                GROUP BY s.site_id
+                ORDER BY s.site_id
+            ''')
+            
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error retrieving sites: {str(e)}")
+            return pd.DataFrame()
+    
+    def get_site_id(self, latitude, longitude):
+        """Get the site at a latitude/longitude, or None if nothing was surveyed there"""
+        lat, lon = (round(float(value), self.SITE_COORDINATE_DIGITS) for value in (latitude, longitude))
+        try:
+            row = self._cached_query("SELECT site_id FROM sites WHERE latitude = ? AND longitude = ?",
+                                     (lat, lon), fetch='one')
+            return row[0] if row else None
+            
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error retrieving site: {str(e)}")
+            return None
+    
+    def get_site_history(self, site_id, start=None, end=None):
+        """Get the observations of one site in [start, end), oldest first.
+        
+        Served by a range scan of the (site_id, observed_at) index. Returns
+        a DataFrame with 'observed_at' (datetime) and 'population'.
+        """
+        query = "SELECT observed_at, population FROM observations WHERE site_id = ?"
+        params = [int(site_id)]
+        if start is not None:
+            query += " AND observed_at >= ?"
+            params.append(format_timestamp(start))
+        if end is not None:
+            query += " AND observed_at < ?"
+            params.append(format_timestamp(end))
+        query += " ORDER BY observed_at"
+        
+        try:
+            df = self._cached_query(query, params)
+            
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error retrieving site history: {str(e)}")
+            return pd.DataFrame(columns=['observed_at', 'population'])
+        
+        df['observed_at'] = pd.to_datetime(df['observed_at'], errors='coerce')
+        return df
+    
+    def get_observations(self, start=None, end=None):
+        """Get every observation in [start, end) with its site, oldest first"""
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append("o.observed_at >= ?")
+            params.append(format_timestamp(start))
+        if end is not None:
+            conditions.append("o.observed_at < ?")
+            params.append(format_timestamp(end))
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        
+        try:
+            df = self._cached_query(f'''
+                SELECT o.site_id, o.observed_at, o.population, s.latitude, s.longitude
+                FROM observations o
+                JOIN sites s ON s.site_id = o.site_id
+                {where}
+                ORDER BY o.observed_at
+            ''', params)
+            
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error retrieving observations: {str(e)}")
+            return pd.DataFrame(columns=['site_id', 'observed_at', 'population', 'latitude', 'longitude'])
+        
+        df['observed_at'] = pd.to_datetime(df['observed_at'], errors='coerce')
+        return df
+    
+    def get_change_token(self):
+        """Get the current change token without reading any rows, or None on failure"""
+        try:
+            with self.connections.reader() as conn:
+                return change_log.current_token(conn)
+            
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error retrieving changes: {str(e)}")
+            return None
+    
+    def get_changes_since(self, token=None):
+        """Get rows inserted, updated and deleted since a change token.
+        
+        Pass None to get the current token; a result with 'reset' set means
+        the caller has to reload everything (see change_log.read_changes).
+        """
+        try:
+            with self.connections.reader() as conn:
+                return change_log.read_changes(conn, token)
+            
+        except (sqlite3.Error, pd.errors.DatabaseError) as e:
+            self.error_occurred.emit(f"Error retrieving changes: {str(e)}")
+            return None
+    
     def get_crab_by_id(self, crab_id):
-        """Get crab data by ID"""
+        """Get crab data by ID, from the live table or the archive holding it"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            query = "SELECT * FROM crab_population WHERE id = ?"
-            df = pd.read_sql_query(query, conn, params=(crab_id,))
-            conn.close()
+            select = "SELECT id, population, latitude, longitude, date_added FROM {}.crab_population WHERE id = ?"
+            df = self._cached_query(select.format('main'), (crab_id,))
+            
+            if df.empty:
+                archive = self._cached_query(
+                    f"SELECT partition_name FROM {ARCHIVED_ID_TABLE} WHERE id = ?", (crab_id,), fetch='one'
+                )
+                if archive is None:
+                    return None
+                df = self._cached_query(select.format(f'"{archive[0]}"'), (crab_id,), attach=[archive[0]])
             
             if df.empty:
                 return None
@@ -141,13 +1441,7 @@ class DatabaseManager(QObject):
     def get_setting(self, key, default=None):
         """Get a setting value"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
-            result = cursor.fetchone()
-            
-            conn.close()
+            result = self._cached_query("SELECT value FROM settings WHERE key = ?", (key,), fetch='one')
             
             if result:
                 return result[0]
@@ -157,21 +1451,41 @@ class DatabaseManager(QObject):
             self.error_occurred.emit(f"Error retrieving setting: {str(e)}")
             return default
     
+    def get_all_settings(self):
+        """Get every setting as a dict of strings"""
+        try:
+            return dict(self._cached_query("SELECT key, value FROM settings", fetch='all'))
+            
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error retrieving settings: {str(e)}")
+            return {}
+    
+    def set_settings(self, values):
+        """Set several setting values in one transaction"""
+        try:
+            with self.connections.writer() as conn:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO settings (key, value)
+                    VALUES (?, ?)
+                ''', list(values.items()))
+            
+            return True
+            
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Error saving settings: {str(e)}")
+            return False
+    
     def set_setting(self, key, value):
         """Set a setting value"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO settings (key, value)
-                VALUES (?, ?)
-            ''', (key, value))
+            with self.connections.writer() as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO settings (key, value)
+                    VALUES (?, ?)
+                ''', (key, value))
             
-            conn.commit()
-            conn.close()
             return True
             
         except sqlite3.Error as e:
             self.error_occurred.emit(f"Error saving setting: {str(e)}")
-            return False
\ No newline at end of file
+            return False
@@ -4,10 +4,15 @@ from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel,
 from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QVariant, QSortFilterProxyModel
 from PyQt5.QtGui import QColor
 
+import numpy as np
 import pandas as pd
 from database import DatabaseManager
+from query_executor import QueryExecutor
 
 class CrabDataTableModel(QAbstractTableModel):
+    # Above this many separate row ranges a removal resets the model instead
+    MAX_REMOVE_RANGES = 100
+    
     def __init__(self, data):
         super().__init__()
         self._data = data
@@ -26,14 +31,14 @@ class CrabDataTableModel(QAbstractTableModel):
         if role == Qt.DisplayRole:
             value = self._data.iloc[index.row(), index.column()]
             # Format based on column type
-            if pd.api.types.is_numeric_dtype(self._data.dtypes[index.column()]):
+            if pd.api.types.is_numeric_dtype(self._data.dtypes.iloc[index.column()]):
                 return str(value)
             else:
                 return str(value)
         
         elif role == Qt.TextAlignmentRole:
             # Align numeric columns to the right
-            if pd.api.types.is_numeric_dtype(self._data.dtypes[index.column()]):
+            if pd.api.types.is_numeric_dtype(self._data.dtypes.iloc[index.column()]):
                 return Qt.AlignRight | Qt.AlignVCenter
             return Qt.AlignLeft | Qt.AlignVCenter
         
@@ -67,6 +72,30 @@ class CrabDataTableModel(QAbstractTableModel):
         
         return QVariant()
     
+    def remove_ids(self, ids):
+        """Remove rows with the given IDs without rebuilding the model"""
+        mask = self._data['id'].isin(ids).to_numpy()
+        positions = np.flatnonzero(mask)
+        if not len(positions):
+            return
+        
+        # Group the positions into contiguous ranges
+        breaks = np.flatnonzero(np.diff(positions) != 1)
+        starts = np.r_[positions[0], positions[breaks + 1]]
+        ends = np.r_[positions[breaks], positions[-1]]
+        
+        if len(starts) > self.MAX_REMOVE_RANGES:
+            self.beginResetModel()
+            self._data = self._data[~mask]
+            self.endResetModel()
+            return
+        
+        # Remove back to front so earlier positions stay valid
+        for start, end in zip(starts[::-1], ends[::-1]):
+            self.beginRemoveRows(QModelIndex(), int(start), int(end))
+            self._data = pd.concat([self._data.iloc[:start], self._data.iloc[end + 1:]])
+            self.endRemoveRows()
+    
     def sort(self, column, order):
         """Sort table by given column number."""
         self.layoutAboutToBeChanged.emit()
@@ -80,6 +109,7 @@ class DatasetsWidget(QWidget):
         
         # Initialize database manager
         self.db_manager = DatabaseManager()
+        self.executor = QueryExecutor.instance()
         
         # Create layout
         layout = QVBoxLayout(self)
@@ -194,14 +224,19 @@ class DatasetsWidget(QWidget):
         
         layout.addLayout(buttons_layout)
         
+        # Start with an empty table until the first load arrives
+        self.set_data(pd.DataFrame())
+        
         # Load initial data
         self.load_data()
     
     def load_data(self):
-        """Load data from database"""
-        # Get crab data from database
-        df = self.db_manager.get_all_crab_data()
-        
+        """Load data from database in the background"""
+        self.executor.submit(self.db_manager.get_all_crab_data,
+                             channel='datasets', callback=self.set_data)
+    
+    def set_data(self, df):
+        """Show a freshly loaded DataFrame in the table"""
         if df.empty:
             # Create empty dataframe with correct columns
             df = pd.DataFrame(columns=['id', 'population', 'latitude', 'longitude', 'date_added'])
@@ -216,6 +251,9 @@ class DatasetsWidget(QWidget):
         
         # Set model to table view
         self.table_view.setModel(self.proxy_model)
+        
+        # Keep the current search applied to the new data
+        self.filter_data()
     
     def filter_data(self):
         """Filter data based on search input and filter column"""
@@ -255,8 +293,11 @@ class DatasetsWidget(QWidget):
     
     def delete_selected(self):
         """Delete selected rows from database"""
-        # Get selected rows
-        selected_rows = self.table_view.selectionModel().selectedRows()
+        # Get selected rows from the selection ranges; selectedRows() builds
+        # an index per row and is slow for large shift-click selections
+        selection = self.table_view.selectionModel().selection()
+        selected_rows = sorted({row for selected in selection
+                                for row in range(selected.top(), selected.bottom() + 1)})
         
         if not selected_rows:
             self.show_error("No rows selected.")
@@ -290,33 +331,37 @@ class DatasetsWidget(QWidget):
                 df = source_model._data
                 
                 # Get indices in original dataframe
-                indices_to_delete = []
-                for index in selected_rows:
-                    source_index = self.proxy_model.mapToSource(index)
-                    indices_to_delete.append(source_index.row())
+                indices_to_delete = [
+                    self.proxy_model.mapToSource(self.proxy_model.index(row, 0)).row()
+                    for row in selected_rows
+                ]
                 
                 # Get IDs to delete
                 ids_to_delete = df.iloc[indices_to_delete]['id'].tolist()
                 
-                # Delete from database
-                conn = self.db_manager.db_path
-                import sqlite3
-                conn = sqlite3.connect(conn)
-                cursor = conn.cursor()
-                
-                for id_val in ids_to_delete:
-                    cursor.execute("DELETE FROM crab_population WHERE id = ?", (id_val,))
-                
-                conn.commit()
-                conn.close()
-                
-                # Reload data
-                self.load_data()
-                
-                self.show_success(f"Successfully deleted {len(ids_to_delete)} rows.")
-                
             except Exception as e:
                 self.show_error(f"Error deleting data: {str(e)}")
+                return
+            
+            # Delete from database in the background
+            self.delete_btn.setEnabled(False)
+            self.executor.submit(
+                self.db_manager.delete_crab_ids, ids_to_delete,
+                callback=lambda deleted: self.on_rows_deleted(ids_to_delete, deleted),
+                error_callback=lambda error: self.on_rows_deleted(ids_to_delete, None, error)
+            )
+    
+    def on_rows_deleted(self, ids, deleted, error=None):
+        """Drop deleted rows from the table once the database delete is done"""
+        self.delete_btn.setEnabled(True)
+        if deleted is None:
+            self.show_error(f"Error deleting data: {error}" if error else "Error deleting data.")
+            return
+        
+        # Drop the rows from the table in place
+        self.model.remove_ids(ids)
+        
+        self.show_success(f"Successfully deleted {deleted} rows.")
     
     def show_error(self, message):
         """Show error message"""
@@ -1,24 +1,146 @@
 import os
+import re
 import json
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
                             QComboBox, QPushButton, QSlider, QFrame)
 from PyQt5.QtWebEngineWidgets import QWebEngineView
-from PyQt5.QtCore import Qt, QUrl, pyqtSlot
+from PyQt5.QtWebEngineCore import (QWebEngineUrlRequestJob, QWebEngineUrlScheme,
+                                   QWebEngineUrlSchemeHandler)
+from PyQt5.QtCore import Qt, QObject, QUrl, QUrlQuery, QBuffer, QIODevice, pyqtSignal, pyqtSlot
 from PyQt5.QtWebChannel import QWebChannel
 
 from database import DatabaseManager
+from query_executor import QueryExecutor
 from styles import get_map_dark_mode_css
-import folium
-from folium.plugins import HeatMap, MarkerCluster
 from jinja2 import Template
-from branca.element import Figure
+
+from heat_tiles import HeatTileRenderer, TILE_HOST, TILE_SCHEME
+from map_layers import children_payload, viewport_payload
+
+class MapBridge(QObject):
+    """Object the map page reaches over the web channel as 'bridge'.
+    
+    The page reports its bounds and zoom after every move through
+    request_view() and gets the features for that viewport back through
+    view_data; clicking a cluster asks for its children the same way. The
+    view and the population threshold are pushed to it and applied in the
+    page. A request that fails is answered with its seq and the error.
+    """
+    view_data = pyqtSignal(str)
+    children_data = pyqtSignal(str)
+    view_failed = pyqtSignal(int, str)
+    children_failed = pyqtSignal(int, str)
+    view_changed = pyqtSignal(str)
+    min_population_changed = pyqtSignal(int)
+    
+    # (seq, south, west, north, east, zoom) of a viewport the page shows
+    view_requested = pyqtSignal(int, float, float, float, float, float)
+    
+    # Cluster ids need up to 45 bits, so they cross the channel as doubles
+    children_requested = pyqtSignal(int, float)
+    
+    def __init__(self, view, min_population=0):
+        super().__init__()
+        self.view = view
+        self.min_population = min_population
+        self.last_request = None
+    
+    @pyqtSlot()
+    def ready(self):
+        """Called by the page once its channel is connected; replays the current state"""
+        self.view_changed.emit(self.view)
+        self.min_population_changed.emit(self.min_population)
+    
+    @pyqtSlot(int, float, float, float, float, float)
+    def request_view(self, seq, south, west, north, east, zoom):
+        """Called by the page when its viewport changed"""
+        self.last_request = (seq, south, west, north, east, zoom)
+        self.view_requested.emit(*self.last_request)
+    
+    @pyqtSlot(int, float)
+    def request_children(self, seq, cluster_id):
+        """Called by the page when a cluster is clicked"""
+        self.children_requested.emit(seq, cluster_id)
+    
+    def send_view(self, payload):
+        self.view_data.emit(payload)
+    
+    def send_children(self, payload):
+        self.children_data.emit(payload)
+    
+    def send_view_error(self, seq, error):
+        self.view_failed.emit(seq, error)
+    
+    def send_children_error(self, seq, error):
+        self.children_failed.emit(seq, error)
+    
+    def set_view(self, view):
+        self.view = view
+        self.view_changed.emit(view)
+    
+    def set_min_population(self, value):
+        self.min_population = value
+        self.min_population_changed.emit(value)
+
+def register_tile_scheme():
+    """Declare the tile scheme; must run before the QApplication is created"""
+    scheme = QWebEngineUrlScheme(TILE_SCHEME)
+    scheme.setSyntax(QWebEngineUrlScheme.Syntax.Host)
+    scheme.setFlags(QWebEngineUrlScheme.SecureScheme | QWebEngineUrlScheme.CorsEnabled)
+    QWebEngineUrlScheme.registerScheme(scheme)
+
+class HeatTileSchemeHandler(QWebEngineUrlSchemeHandler):
+    """Answers crabtiles:// requests with tiles rendered on the query executor"""
+    TILE_PATH = re.compile(r'/(\d+)/(\d+)/(\d+)\.png')
+    
+    def __init__(self, renderer, parent=None):
+        super().__init__(parent)
+        self.renderer = renderer
+        self.executor = QueryExecutor.instance()
+    
+    def requestStarted(self, job):
+        url = job.requestUrl()
+        match = self.TILE_PATH.fullmatch(url.path())
+        if url.host() != TILE_HOST or match is None:
+            job.fail(QWebEngineUrlRequestJob.UrlNotFound)
+            return
+        
+        zoom, x, y = (int(value) for value in match.groups())
+        min_population = int(QUrlQuery(url).queryItemValue('min') or 0)
+        
+        # The page may cancel the request, destroying the job, before the
+        # tile is ready
+        alive = [True]
+        job.destroyed.connect(lambda: alive.__setitem__(0, False))
+        
+        def reply(data):
+            if alive[0]:
+                buffer = QBuffer(job)
+                buffer.setData(data)
+                buffer.open(QIODevice.ReadOnly)
+                job.reply(b'image/png', buffer)
+        
+        def fail(error):
+            if alive[0]:
+                job.fail(QWebEngineUrlRequestJob.RequestFailed)
+        
+        self.executor.submit(self.renderer.tile, zoom, x, y, min_population,
+                             callback=reply, error_callback=fail)
 
 class GISWidget(QWidget):
+    # Negros Occidental, Philippines
+    CENTER_LAT = 10.4
+    CENTER_LON = 123.0
+    ZOOM = 9
+    
+    MAP_TEMPLATE = os.path.join('assets', 'leaflet_templates', 'map_templates.html')
+    
     def __init__(self):
         super().__init__()
         
         # Initialize database manager
         self.db_manager = DatabaseManager()
+        self.executor = QueryExecutor.instance()
         
         # Create layout
         layout = QVBoxLayout(self)
@@ -54,7 +176,7 @@ class GISWidget(QWidget):
             border: 1px solid rgba(255, 255, 255, 0.2);
             border-radius: 5px;
         """)
-        self.view_combo.currentIndexChanged.connect(self.update_map)
+        self.view_combo.currentTextChanged.connect(self.on_view_changed)
         
         # Density filter
         density_label = QLabel("Population Density:")
@@ -83,7 +205,7 @@ class GISWidget(QWidget):
                 border-radius: 4px;
             }
         """)
-        self.density_slider.valueChanged.connect(self.update_map)
+        self.density_slider.valueChanged.connect(self.on_density_changed)
         
         # Refresh button
         self.refresh_btn = QPushButton("Refresh Data")
@@ -106,115 +228,63 @@ class GISWidget(QWidget):
         self.web_view = QWebEngineView()
         layout.addWidget(self.web_view, 1)  # Give it a stretch factor of 1
         
-        # Initialize map
-        self.update_map()
+        # The page is loaded once and fed through the bridge from then on
+        self.bridge = MapBridge(self.view_combo.currentText(), self.density_slider.value())
+        self.bridge.view_requested.connect(self.on_view_requested)
+        self.bridge.children_requested.connect(self.on_children_requested)
+        self.channel = QWebChannel(self.web_view.page())
+        self.channel.registerObject('bridge', self.bridge)
+        self.web_view.page().setWebChannel(self.channel)
+        
+        # Heat map tiles are rendered here and fetched by the page as images
+        self.tile_handler = HeatTileSchemeHandler(
+            HeatTileRenderer.for_connections(self.db_manager.connections), self)
+        profile = self.web_view.page().profile()
+        if profile.urlSchemeHandler(TILE_SCHEME) is None:
+            profile.installUrlSchemeHandler(TILE_SCHEME, self.tile_handler)
+        self.load_page()
         
+    def load_page(self):
+        """Load the Leaflet page with the dark mode styles"""
+        with open(self.MAP_TEMPLATE, encoding='utf-8') as f:
+            html = Template(f.read()).render(
+                css=get_map_dark_mode_css(),
+                center_lat=self.CENTER_LAT,
+                center_lon=self.CENTER_LON,
+                zoom=self.ZOOM
+            )
+        self.web_view.setHtml(html, QUrl.fromLocalFile(os.path.abspath(self.MAP_TEMPLATE)))
+    
     def update_map(self):
-        """Update the map with current data and settings"""
-        # Get crab data from database
-        df = self.db_manager.get_all_crab_data()
-        
-        # Create a Figure object
-        fig = Figure(width='100%', height='100%')
-        
-        # Create map centered on Negros Occidental
-        # Coordinates for Negros Occidental, Philippines
-        center_lat = 10.4
-        center_lon = 123.0
-        
-        m = folium.Map(
-            location=[center_lat, center_lon],
-            zoom_start=9,  # Zoom level to show the province
-            tiles='CartoDB dark_matter',  # Dark mode tiles
-            width='100%',
-            height='100%'
-        )
-        
-        # Add map to figure
-        fig.add_child(m)
-        
-        # Add province boundary for Negros Occidental if available
-        # This would require GeoJSON data for the province boundary
-        
-        if not df.empty:
-            # Apply density filter
-            min_population = self.density_slider.value()
-            if min_population > 0:
-                df = df[df['population'] >= min_population]
-            
-            # Add data to map based on view type
-            view_type = self.view_combo.currentText()
-            
-            if view_type == "Markers":
-                # Create marker for each data point
-                for _, row in df.iterrows():
-                    popup_html = self.create_popup_html(row)
-                    folium.Marker(
-                        location=[row['latitude'], row['longitude']],
-                        popup=folium.Popup(popup_html, max_width=300),
-                        icon=folium.Icon(color='blue', icon='info-sign')
-                    ).add_to(m)
-                    
-            elif view_type == "Heat Map":
-                # Create heat map
-                heat_data = [[row['latitude'], row['longitude'], row['population']] for _, row in df.iterrows()]
-                HeatMap(heat_data, radius=15).add_to(m)
-                
-            elif view_type == "Clusters":
-                # Create marker cluster
-                marker_cluster = MarkerCluster().add_to(m)
-                
-                for _, row in df.iterrows():
-                    popup_html = self.create_popup_html(row)
-                    folium.Marker(
-                        location=[row['latitude'], row['longitude']],
-                        popup=folium.Popup(popup_html, max_width=300),
-                        icon=folium.Icon(color='blue')
-                    ).add_to(marker_cluster)
-        else:
-            # Add a message if no data
-            folium.Marker(
-                location=[center_lat, center_lon],
-                popup="No data available. Please upload crab population data.",
-                icon=folium.Icon(color='red', icon='info-sign')
-            ).add_to(m)
-        
-        # Add custom CSS for dark mode
-        custom_css = get_map_dark_mode_css()
-        folium.Element(f"<style>{custom_css}</style>").add_to(m)
-        
-        # Save map to HTML file
-        map_html = os.path.join('assets', 'leaflet_templates', 'temp_map.html')
-        os.makedirs(os.path.dirname(map_html), exist_ok=True)
-        fig.save(map_html)
-        
-        # Load map in web view
-        self.web_view.load(QUrl.fromLocalFile(os.path.abspath(map_html)))
-    
-    def create_popup_html(self, row):
-        """Create HTML for popup"""
-        template = """
-        <div class="popup-content">
-            <div class="info-title">Blue Crab Population</div>
-            <div class="info-row">
-                <span class="info-label">ID:</span> {{ id }}
-            </div>
-            <div class="info-row">
-                <span class="info-label">Population:</span> {{ population }}
-            </div>
-            <div class="info-row">
-                <span class="info-label">Coordinates:</span> {{ latitude }}, {{ longitude }}
-            </div>
-            <div class="info-row">
-                <span class="info-label">Date Added:</span> {{ date_added }}
-            </div>
-        </div>
-        """
-        
-        return Template(template).render(
-            id=row['id'],
-            population=row['population'],
-            latitude=row['latitude'],
-            longitude=row['longitude'],
-            date_added=row['date_added']
-        )
\ No newline at end of file
+        """Reload the features of the viewport the page shows"""
+        if self.bridge.last_request is not None:
+            self.on_view_requested(*self.bridge.last_request)
+    
+    def on_view_requested(self, seq, south, west, north, east, zoom):
+        """Query the viewport in the background; a newer request supersedes it"""
+        self.executor.submit(self.load_view, seq, (south, west, north, east), zoom,
+                             self.bridge.min_population, self.bridge.view,
+                             channel='gis', callback=self.bridge.send_view,
+                             error_callback=lambda error: self.bridge.send_view_error(seq, error))
+    
+    def load_view(self, seq, bounds, zoom, min_population, view):
+        """Serialize the features of one viewport (runs off the GUI thread)"""
+        return json.dumps(viewport_payload(self.db_manager, seq, bounds, zoom, min_population, view))
+    
+    def on_children_requested(self, seq, cluster_id):
+        """Look up the children of a clicked cluster in the background"""
+        self.executor.submit(self.load_children, seq, int(cluster_id), self.bridge.min_population,
+                             channel='gis-children', callback=self.bridge.send_children,
+                             error_callback=lambda error: self.bridge.send_children_error(seq, error))
+    
+    def load_children(self, seq, cluster_id, min_population):
+        """Serialize the children of one cluster (runs off the GUI thread)"""
+        return json.dumps(children_payload(self.db_manager, seq, cluster_id, min_population))
+    
+    def on_view_changed(self, view):
+        """Switch between markers, heat map and clusters in the page"""
+        self.bridge.set_view(view)
+    
+    def on_density_changed(self, value):
+        """Apply the minimum population filter in the page"""
+        self.bridge.set_min_population(value)
@@ -0,0 +1,270 @@
+import os
+import shutil
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+import change_log
+from clustering import project
+from data_store import CrabDataStore
+
+# Tiles are requested as crabtiles://heat/{z}/{x}/{y}.png?min=N&v=TOKEN
+TILE_SCHEME = b'crabtiles'
+TILE_HOST = 'heat'
+
+# leaflet.heat's default gradient, so the tiles look like the old heat layer
+GRADIENT = [
+    (0.4, (0, 0, 255)),
+    (0.6, (0, 255, 255)),
+    (0.7, (0, 255, 0)),
+    (0.8, (255, 255, 0)),
+    (1.0, (255, 0, 0))
+]
+
+def encode_png(rgba):
+    """Encode an (height, width, 4) uint8 array as an RGBA PNG"""
+    height, width = rgba.shape[:2]
+    
+    # Every scanline starts with filter type 0 (none)
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+    
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+    
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6))
+            + chunk(b'IEND', b''))
+
+def gradient_lut(max_alpha=204):
+    """256-entry RGBA lookup table from 0 (transparent) to full intensity"""
+    stops = np.array([stop for stop, _ in GRADIENT])
+    colors = np.array([color for _, color in GRADIENT], dtype=np.float64)
+    levels = np.linspace(0.0, 1.0, 256)
+    
+    lut = np.empty((256, 4), dtype=np.uint8)
+    for channel in range(3):
+        lut[:, channel] = np.interp(levels, stops, colors[:, channel]).round()
+    
+    # Fade in over the first gradient stop, like leaflet.heat
+    lut[:, 3] = (np.clip(levels / stops[0], 0.0, 1.0) * max_alpha).round()
+    return lut
+
+class HeatTileRenderer:
+    """Heat map raster tiles rendered with NumPy.
+    
+    For each tile the population of the points around it is binned into
+    pixels, blurred with a separable Gaussian and mapped through the heat
+    gradient, so panning and zooming only fetch images. Intensity is scaled
+    by the 99th percentile population for the whole dataset rather than per
+    tile, so neighbouring tiles match at their edges.
+    
+    Tiles are kept on disk under data/heat_tiles, keyed by the database id,
+    the change log token and the population threshold; a new token or a
+    different database makes every older tile stale and they are deleted.
+    The cache is least-recently-used and capped at CACHE_BYTES.
+    """
+    TILE_SIZE = 256
+    MAX_ZOOM = 20
+    
+    # Kernel width in pixels, close to leaflet.heat's radius 15 / blur 15
+    SIGMA = 6.0
+    
+    # Zoom at which a lone point of the reference population peaks at full
+    # intensity; each level out halves it, as leaflet.heat's maxZoom does
+    FULL_ZOOM = 14
+    
+    CACHE_BYTES = 256 * 1024 * 1024
+    
+    _instances = {}
+    _instances_lock = threading.Lock()
+    
+    @classmethod
+    def for_connections(cls, connections):
+        """Return the shared renderer for a connection manager"""
+        with cls._instances_lock:
+            renderer = cls._instances.get(connections.db_path)
+            if renderer is None or renderer.connections is not connections:
+                renderer = cls(connections)
+                cls._instances[connections.db_path] = renderer
+            return renderer
+    
+    def __init__(self, connections):
+        self.connections = connections
+        self.cache_dir = os.path.join(os.path.dirname(connections.db_path), 'heat_tiles')
+        
+        radius = int(np.ceil(3 * self.SIGMA))
+        offsets = np.arange(-radius, radius + 1)
+        kernel = np.exp(-offsets ** 2 / (2 * self.SIGMA ** 2))
+        self._kernel = kernel / kernel.sum()
+        self._lut = gradient_lut()
+        self._empty_tile = encode_png(np.zeros((self.TILE_SIZE, self.TILE_SIZE, 4), dtype=np.uint8))
+        
+        # Projected points sorted by x, their populations and the scale
+        self._points = None
+        self._version = None
+        self._token = None
+        self._generation = None
+        self._lock = threading.Lock()
+        
+        # Relative tile path -> size, least recently used first
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_lock = threading.Lock()
+        self._scan_cache()
+    
+    def version(self):
+        """Change token the current tiles are rendered from"""
+        return self._update()[1]
+    
+    def tile(self, zoom, x, y, min_population=0):
+        """PNG bytes of one tile, from the disk cache when possible"""
+        points, _, generation = self._update()
+        
+        # Tiles on disk cannot be matched to a database without an id yet
+        if generation is None:
+            return self._render(points, zoom, x, y, min_population)
+        
+        key = os.path.join(generation, str(min_population), str(zoom), str(x), f'{y}.png')
+        data = self._read_cached(key)
+        if data is None:
+            data = self._render(points, zoom, x, y, min_population)
+            if data is not self._empty_tile:
+                self._write_cached(key, data)
+        return data
+    
+    def _render(self, points, zoom, x, y, min_population):
+        if not 0 <= zoom <= self.MAX_ZOOM or not 0 <= y < 2 ** zoom:
+            return self._empty_tile
+        x %= 2 ** zoom
+        
+        xs, ys, weights, scale = points
+        world = self.TILE_SIZE * 2 ** zoom
+        margin = len(self._kernel) // 2
+        size = self.TILE_SIZE + 2 * margin
+        left = x * self.TILE_SIZE - margin
+        top = y * self.TILE_SIZE - margin
+        
+        # Points whose kernel reaches the tile
+        low, high = np.searchsorted(xs, [left / world, (left + size) / world])
+        columns = xs[low:high] * world - left
+        rows = ys[low:high] * world - top
+        tile_weights = weights[low:high]
+        inside = (rows >= 0) & (rows < size) & (columns < size) & (tile_weights >= min_population)
+        if not inside.any():
+            return self._empty_tile
+        
+        cells = rows[inside].astype(np.int64) * size + columns[inside].astype(np.int64)
+        grid = np.bincount(cells, weights=tile_weights[inside], minlength=size * size).reshape(size, size)
+        
+        # Separable blur, computed for the tile pixels only
+        blurred = sum(k * grid[:, i:i + self.TILE_SIZE] for i, k in enumerate(self._kernel))
+        blurred = sum(k * blurred[i:i + self.TILE_SIZE, :] for i, k in enumerate(self._kernel))
+        
+        # Fainter points further out, so dense areas keep their structure
+        peak = scale * self._kernel[margin] ** 2 * 2.0 ** max(0, min(self.FULL_ZOOM - zoom, 12))
+        intensity = np.clip(blurred / peak, 0.0, 1.0)
+        return encode_png(self._lut[(intensity * 255).astype(np.uint8)])
+    
+    def _update(self):
+        """Reproject the points when something was committed.
+        
+        Returns the points, the token they belong to and the cache
+        generation, '<database id>-<token>' or None while the database has
+        no id, read together.
+        """
+        version = self.connections.cache_version()
+        with self._lock:
+            if version == self._version:
+                return self._points, self._token, self._generation
+            
+            # Token first: the frame read after it is at least as new
+            with self.connections.reader() as conn:
+                token = change_log.current_token(conn)
+                database_id = change_log.database_id(conn)
+            generation = f'{database_id}-{token}' if database_id is not None else None
+            frame = CrabDataStore.for_connections(self.connections).get_frame()
+            
+            xs, ys = project(frame['latitude'].to_numpy(), frame['longitude'].to_numpy())
+            order = np.argsort(xs, kind='stable')
+            weights = frame['population'].to_numpy(dtype=np.float64)[order]
+            scale = max(float(np.percentile(weights, 99)), 1.0) if len(weights) else 1.0
+            self._points = (xs[order], ys[order], weights, scale)
+            
+            if generation != self._generation:
+                self._drop_stale(generation)
+            self._token = token
+            self._generation = generation
+            self._version = version
+            return self._points, self._token, self._generation
+    
+    def _scan_cache(self):
+        """Index the tiles already on disk, oldest first"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, os.path.relpath(path, self.cache_dir), info.st_size))
+        
+        for _, key, size in sorted(entries):
+            self._cache[key] = size
+            self._cache_bytes += size
+    
+    def _read_cached(self, key):
+        with self._cache_lock:
+            if key not in self._cache:
+                return None
+            self._cache.move_to_end(key)
+        
+        path = os.path.join(self.cache_dir, key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            
+            # The modification time orders the cache across restarts
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+    
+    def _write_cached(self, key, data):
+        path = os.path.join(self.cache_dir, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            # The cache is only an accelerator
+            return
+        
+        with self._cache_lock:
+            self._cache_bytes += len(data) - self._cache.pop(key, 0)
+            self._cache[key] = len(data)
+            
+            while self._cache_bytes > self.CACHE_BYTES and self._cache:
+                old_key, size = self._cache.popitem(last=False)
+                self._cache_bytes -= size
+                try:
+                    os.remove(os.path.join(self.cache_dir, old_key))
+                except OSError:
+                    pass
+    
+    def _drop_stale(self, current):
+        """Delete the tiles of every generation but current"""
+        with self._cache_lock:
+            for key in [key for key in self._cache if key.split(os.sep, 1)[0] != current]:
+                self._cache_bytes -= self._cache.pop(key)
+        
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name != current:
+                    shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
@@ -0,0 +1,244 @@
+"""Headless ingestion of survey CSV files dropped into a shared folder.
+
+    python ingest_daemon.py /path/to/dropbox --db data/blue_crab.db
+
+Files are picked up once they stop changing, checked with the same rules
+as the upload page, imported into crab_population and moved to the
+processed/ or failed/ subfolder of the watched directory. Files that
+could not be written because the database was busy stay where they are
+and are tried again on a later poll.
+"""
+import argparse
+import logging
+import os
+import shutil
+import signal
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from csv_importer import CsvImporter
+from database import DatabaseManager
+from utils import validate_csv
+
+logger = logging.getLogger('ingest')
+
+class IngestDaemon:
+    """Polls a directory and imports CSV files once they are complete.
+    
+    A file counts as complete when its size and modification time were the
+    same on two polls and it has not been modified for STABLE_SECONDS, so
+    files still being copied in are left alone. Validation of up to
+    max_workers files overlaps; the imports themselves take turns on
+    the shared writer connection, one file at a time.
+    """
+    POLL_INTERVAL = 5.0
+    STABLE_SECONDS = 10.0
+    MAX_WORKERS = 2
+    
+    PROCESSED_DIR = 'processed'
+    FAILED_DIR = 'failed'
+    
+    # Names written by copy tools while a transfer is in progress
+    PARTIAL_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload')
+    
+    def __init__(self, watch_dir, db_manager, mode='append', max_workers=None,
+                 poll_interval=None, stable_seconds=None):
+        if mode not in CsvImporter.MODES:
+            raise ValueError(f"Unknown import mode: {mode}")
+        
+        self.watch_dir = os.path.abspath(watch_dir)
+        self.processed_dir = os.path.join(self.watch_dir, self.PROCESSED_DIR)
+        self.failed_dir = os.path.join(self.watch_dir, self.FAILED_DIR)
+        self.db_manager = db_manager
+        self.mode = mode
+        self.max_workers = max_workers or self.MAX_WORKERS
+        self.poll_interval = poll_interval if poll_interval is not None else self.POLL_INTERVAL
+        self.stable_seconds = stable_seconds if stable_seconds is not None else self.STABLE_SECONDS
+        
+        self.stats = {'files': 0, 'failed': 0, 'rows': 0, 'seconds': 0.0}
+        
+        self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='ingest')
+        self._seen = {}
+        self._active = set()
+        self._lock = threading.Lock()
+        self._import_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        
+        os.makedirs(self.processed_dir, exist_ok=True)
+        os.makedirs(self.failed_dir, exist_ok=True)
+    
+    def run(self, once=False):
+        """Poll until stop() is called; with once, import what is ready and return"""
+        logger.info("Watching %s (%s mode, %d workers)", self.watch_dir, self.mode, self.max_workers)
+        try:
+            while not self._stop_event.is_set():
+                ready = self.poll()
+                if once and not ready and not self._active and not self._pending():
+                    break
+                self._stop_event.wait(self.poll_interval)
+        finally:
+            self._pool.shutdown(wait=True)
+            self.log_totals()
+    
+    def stop(self):
+        """Stop polling; imports already running are finished first"""
+        self._stop_event.set()
+    
+    def poll(self):
+        """Scan the directory once and queue the files that are complete"""
+        now = time.time()
+        current = {}
+        
+        try:
+            entries = list(os.scandir(self.watch_dir))
+        except OSError as e:
+            logger.error("Cannot read %s: %s", self.watch_dir, e)
+            return []
+        
+        for entry in entries:
+            name = entry.name
+            if (not entry.is_file() or name.startswith('.') or not name.lower().endswith('.csv')
+                    or name.lower().endswith(self.PARTIAL_SUFFIXES)):
+                continue
+            try:
+                info = entry.stat()
+            except OSError:
+                continue
+            current[entry.path] = (info.st_size, info.st_mtime_ns)
+        
+        ready = []
+        with self._lock:
+            for path, signature in current.items():
+                if path in self._active:
+                    continue
+                
+                stable = self._seen.get(path) == signature
+                quiet = now - signature[1] / 1e9 >= self.stable_seconds
+                if stable and quiet:
+                    self._active.add(path)
+                    ready.append(path)
+            self._seen = current
+        
+        for path in ready:
+            self._pool.submit(self.ingest, path)
+        return ready
+    
+    def ingest(self, path):
+        """Validate and import one file, then move it out of the watched folder"""
+        name = os.path.basename(path)
+        started = time.perf_counter()
+        try:
+            valid, message = validate_csv(path)
+            validated = time.perf_counter()
+            
+            success = False
+            if valid:
+                importer = CsvImporter(self.db_manager, path, mode=self.mode)
+                # Waiting here rather than on the writer, whose busy timeout
+                # a long import in the other worker would outlast
+                with self._import_lock:
+                    import_started = time.perf_counter()
+                    success = importer.run()
+                message = importer.message
+            
+            elapsed = time.perf_counter() - started
+            if not success and self._is_busy(importer.error if valid else None):
+                # Another writer held the database; the next polls pick the file up again
+                logger.warning("%s: database busy, will retry: %s", name, message)
+                return False
+            
+            if success:
+                rows = importer.rows_imported
+                import_seconds = time.perf_counter() - import_started
+                rate = rows / import_seconds if import_seconds else 0.0
+                logger.info("%s: %s rows in %.2f s (%s rows/s, validation %.2f s)",
+                            name, f"{rows:,}", elapsed, f"{rate:,.0f}", validated - started)
+                self._move(path, self.processed_dir)
+            else:
+                logger.warning("%s rejected: %s", name, message)
+                self._move(path, self.failed_dir, message)
+            
+            with self._lock:
+                self.stats['files'] += 1
+                self.stats['failed'] += not success
+                self.stats['rows'] += importer.rows_imported if success else 0
+                self.stats['seconds'] += elapsed
+            return success
+        
+        except Exception:
+            logger.exception("%s: unexpected error", name)
+            return False
+        finally:
+            with self._lock:
+                self._active.discard(path)
+                self._seen.pop(path, None)
+    
+    def log_totals(self):
+        """Log the totals since the daemon started"""
+        stats = self.stats
+        rate = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+        logger.info("%d files (%d failed), %s rows, %s rows/s overall",
+                    stats['files'], stats['failed'], f"{stats['rows']:,}", f"{rate:,.0f}")
+    
+    @staticmethod
+    def _is_busy(error):
+        """Whether an import failed only because the database was locked"""
+        if not isinstance(error, sqlite3.OperationalError):
+            return False
+        text = str(error).lower()
+        return 'locked' in text or 'busy' in text
+    
+    def _pending(self):
+        """Whether any file in the folder is still waiting to become stable"""
+        with self._lock:
+            return bool(self._seen)
+    
+    def _move(self, path, folder, error=None):
+        """Move a file into folder without overwriting an earlier file of the same name"""
+        base, ext = os.path.splitext(os.path.basename(path))
+        target = os.path.join(folder, base + ext)
+        if os.path.exists(target):
+            target = os.path.join(folder, f"{base}-{time.strftime('%Y%m%d-%H%M%S')}{ext}")
+        
+        shutil.move(path, target)
+        
+        # Leave the reason next to a rejected file
+        if error is not None:
+            with open(target + '.error.txt', 'w') as f:
+                f.write(error + '\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import crab survey CSV files dropped into a folder.")
+    parser.add_argument('watch_dir', help="folder the field stations drop CSV files into")
+    parser.add_argument('--db', default='data/blue_crab.db', help="database file (default: %(default)s)")
+    parser.add_argument('--mode', choices=CsvImporter.MODES, default='append',
+                        help="append new rows, or merge rows by ID (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=IngestDaemon.MAX_WORKERS,
+                        help="files validated and imported concurrently (default: %(default)s)")
+    parser.add_argument('--interval', type=float, default=IngestDaemon.POLL_INTERVAL,
+                        help="seconds between directory scans (default: %(default)s)")
+    parser.add_argument('--stable', type=float, default=IngestDaemon.STABLE_SECONDS,
+                        help="seconds a file must stay unchanged before import (default: %(default)s)")
+    parser.add_argument('--once', action='store_true',
+                        help="import the files present now and exit")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    
+    db_manager = DatabaseManager(args.db)
+    db_manager.error_occurred.connect(logger.error)
+    
+    daemon = IngestDaemon(args.watch_dir, db_manager, mode=args.mode, max_workers=args.workers,
+                          poll_interval=args.interval, stable_seconds=args.stable)
+    
+    # Finish the files in progress on Ctrl+C or a service stop
+    signal.signal(signal.SIGINT, lambda *_: daemon.stop())
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    
+    daemon.run(once=args.once)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
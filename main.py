@@ -2,9 +2,15 @@ import sys
 from PyQt5.QtWidgets import QApplication
 from splash_screen import SplashScreen
 from main_window import MainWindow
+from database import ConnectionManager
+from maintenance import MaintenanceService
+from gis import register_tile_scheme
 
 if __name__ == "__main__":
+    # Custom URL schemes must be known before the application starts
+    register_tile_scheme()
     app = QApplication(sys.argv)
+    app.aboutToQuit.connect(ConnectionManager.close_all)
     
     # Show splash screen
     splash = SplashScreen()
@@ -13,6 +19,9 @@ if __name__ == "__main__":
     # Create main window but don't show it yet
     main_window = MainWindow()
     
+    # Scheduled backups and idle-time database maintenance
+    MaintenanceService.instance().start()
+    
     # Connect splash screen finished signal to show main window
     splash.splash_finished.connect(lambda: main_window.show())
     
@@ -0,0 +1,314 @@
+import glob
+import os
+import sqlite3
+import threading
+import time
+
+from PyQt5.QtCore import QCoreApplication, QObject, QTimer, pyqtSignal
+
+import change_log
+from database import DatabaseManager
+from query_executor import QueryExecutor
+
+class MaintenanceCancelled(Exception):
+    """Raised inside a maintenance task when the service is stopped"""
+
+class MaintenanceService(QObject):
+    """Background backups, planner statistics and space reclamation.
+    
+    Every task runs on the query executor's thread pool in small steps so
+    the GUI and other writers keep going, and reports its timings and the
+    bytes it wrote or reclaimed through task_finished:
+    
+    - backup() copies the database with the online backup API a few
+      hundred pages at a time, on request and whenever the newest backup
+      is a day old, including right at start;
+    - optimize() refreshes the planner statistics with a bounded ANALYZE,
+      and runs by itself once many rows changed, e.g. after a large import;
+    - reclaim() prunes the change log and hands free pages back to the file
+      system with incremental vacuum whenever the database is idle.
+    """
+    task_finished = pyqtSignal(dict)
+    task_failed = pyqtSignal(str, str)
+    
+    BACKUP_PAGES_PER_STEP = 256
+    BACKUP_STEP_SLEEP = 0.01
+    BACKUP_KEEP = 7
+    BACKUP_INTERVAL_MS = 24 * 60 * 60 * 1000
+    BACKUP_CHECK_MS = 60 * 60 * 1000
+    
+    # The database counts as idle after a whole interval without commits
+    IDLE_CHECK_MS = 60 * 1000
+    
+    # Re-analyze once this many rows changed; rows sampled per index
+    ANALYZE_MIN_CHANGES = 50000
+    ANALYSIS_LIMIT = 1000
+    
+    VACUUM_PAGES_PER_STEP = 512
+    VACUUM_STEP_SLEEP = 0.01
+    VACUUM_MIN_FREE_PAGES = 1024
+    
+    _instance = None
+    
+    @classmethod
+    def instance(cls):
+        """Return the shared maintenance service"""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+    
+    def __init__(self, db_manager=None):
+        super().__init__()
+        
+        self.db_manager = db_manager or DatabaseManager()
+        self.connections = self.db_manager.connections
+        self.executor = QueryExecutor.instance()
+        self.backup_dir = os.path.join(os.path.dirname(self.connections.db_path), 'backups')
+        self.last_reports = {}
+        
+        # One task at a time; set by stop() to abort a running task
+        self._task_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        
+        self._idle_version = None
+        self._analyzed_token = None
+        
+        self._idle_timer = QTimer(self)
+        self._idle_timer.timeout.connect(self.check_idle)
+        self._backup_timer = QTimer(self)
+        self._backup_timer.timeout.connect(self.check_backup)
+        
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.stop)
+    
+    def start(self):
+        """Start the idle and backup schedules"""
+        self._stop_event.clear()
+        self._idle_timer.start(self.IDLE_CHECK_MS)
+        self._backup_timer.start(self.BACKUP_CHECK_MS)
+        self.check_backup()
+    
+    def stop(self):
+        """Stop the schedules and abort the running task at its next step"""
+        self._idle_timer.stop()
+        self._backup_timer.stop()
+        self._stop_event.set()
+    
+    def run_backup(self, path=None):
+        """Start a backup in the background"""
+        return self._submit('backup', self.backup, path)
+    
+    def run_optimize(self):
+        """Start a statistics refresh in the background"""
+        return self._submit('optimize', self.optimize)
+    
+    def run_reclaim(self):
+        """Start a space reclamation pass in the background"""
+        return self._submit('reclaim', self.reclaim)
+    
+    def check_backup(self):
+        """Start a backup if the newest one is older than BACKUP_INTERVAL_MS"""
+        backups = self._backups()
+        try:
+            age = time.time() - os.path.getmtime(backups[-1]) if backups else None
+        except OSError:
+            age = None
+        
+        if age is None or age * 1000 >= self.BACKUP_INTERVAL_MS:
+            return self.run_backup()
+        return None
+    
+    def check_idle(self):
+        """Run the idle tasks if nothing was committed since the last check"""
+        version = self.connections.cache_version()
+        idle = version == self._idle_version
+        self._idle_version = version
+        
+        if idle:
+            self._submit('idle', self.idle_maintenance)
+    
+    def idle_maintenance(self):
+        """Re-analyze if many rows changed, then reclaim free space"""
+        with self.connections.reader() as conn:
+            token = change_log.current_token(conn)
+        
+        reports = []
+        if self._analyzed_token is None:
+            # Nothing to compare against until the first idle check
+            self._analyzed_token = token
+        elif abs(token - self._analyzed_token) >= self.ANALYZE_MIN_CHANGES:
+            reports.append(self.optimize())
+        
+        reports.append(self.reclaim())
+        return reports
+    
+    def backup(self, path=None):
+        """Copy the database with the online backup API.
+        
+        Without a path the copy goes to data/backups under a timestamped
+        name, and only the newest BACKUP_KEEP backups are kept.
+        """
+        with self._task_lock:
+            started = time.perf_counter()
+            
+            keep_newest = path is None
+            if path is None:
+                os.makedirs(self.backup_dir, exist_ok=True)
+                name = os.path.splitext(os.path.basename(self.connections.db_path))[0]
+                path = os.path.join(self.backup_dir, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.db")
+            tmp_path = path + '.tmp'
+            
+            steps = 0
+            def progress(status, remaining, total):
+                nonlocal steps
+                steps += 1
+                if self._stop_event.is_set():
+                    raise MaintenanceCancelled()
+            
+            source = sqlite3.connect(self.connections.db_path,
+                                     timeout=self.connections.BUSY_TIMEOUT_MS / 1000)
+            target = sqlite3.connect(tmp_path)
+            try:
+                source.backup(target, pages=self.BACKUP_PAGES_PER_STEP, progress=progress,
+                              sleep=self.BACKUP_STEP_SLEEP)
+                check = target.execute("PRAGMA quick_check").fetchone()[0]
+                target.close()
+                if check != 'ok':
+                    raise sqlite3.DatabaseError(f"Backup failed its integrity check: {check}")
+                os.replace(tmp_path, path)
+            finally:
+                target.close()
+                source.close()
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            
+            removed = self._prune_backups() if keep_newest else 0
+            
+            return {
+                'task': 'backup',
+                'path': path,
+                'seconds': time.perf_counter() - started,
+                'steps': steps,
+                'bytes_written': os.path.getsize(path),
+                'backups_removed': removed
+            }
+    
+    def optimize(self):
+        """Refresh the query planner statistics with a bounded ANALYZE"""
+        with self._task_lock:
+            started = time.perf_counter()
+            
+            with self.connections.writer() as conn:
+                token = change_log.current_token(conn)
+                conn.execute(f"PRAGMA analysis_limit = {self.ANALYSIS_LIMIT}")
+                conn.execute("ANALYZE")
+                conn.execute("PRAGMA optimize")
+                stats = conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0]
+            
+            self._analyzed_token = token
+            return {
+                'task': 'optimize',
+                'seconds': time.perf_counter() - started,
+                'indexes_analyzed': stats
+            }
+    
+    def reclaim(self):
+        """Prune the change log and return free pages to the file system.
+        
+        Databases created before incremental auto-vacuum was enabled are
+        converted with one full VACUUM; after that free pages are released
+        VACUUM_PAGES_PER_STEP at a time, each step in its own short
+        transaction.
+        """
+        with self._task_lock:
+            started = time.perf_counter()
+            
+            # Read the page counts on the writer, which always sees the
+            # current header, e.g. right after a VACUUM
+            with self.connections.writer() as conn:
+                pruned = change_log.prune_changes(conn, keep=DatabaseManager.CHANGE_LOG_RETENTION)
+                auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+                page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+                free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            size_before = os.path.getsize(self.connections.db_path)
+            
+            free = free_before
+            mode = 'skipped'
+            if free_before >= self.VACUUM_MIN_FREE_PAGES:
+                if auto_vacuum != 2:
+                    mode = 'full'
+                    with self.connections.autocommit_writer() as conn:
+                        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                        conn.execute("VACUUM")
+                    free = 0
+                else:
+                    mode = 'incremental'
+                    while free > 0:
+                        if self._stop_event.is_set():
+                            raise MaintenanceCancelled()
+                        with self.connections.autocommit_writer() as conn:
+                            # execute() would step the pragma once and free a
+                            # single page; executescript() runs it to the end
+                            conn.executescript(f"PRAGMA incremental_vacuum({self.VACUUM_PAGES_PER_STEP});")
+                            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                        time.sleep(self.VACUUM_STEP_SLEEP)
+                
+                # The file only shrinks once the WAL is checkpointed
+                with self.connections.autocommit_writer() as conn:
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            
+            return {
+                'task': 'reclaim',
+                'mode': mode,
+                'seconds': time.perf_counter() - started,
+                'changes_pruned': pruned,
+                'pages_freed': free_before - free,
+                'bytes_reclaimed': (free_before - free) * page_size,
+                'file_bytes_before': size_before,
+                'file_bytes_after': os.path.getsize(self.connections.db_path)
+            }
+    
+    @staticmethod
+    def describe(report):
+        """One-line summary of a task report"""
+        seconds = report['seconds']
+        if report['task'] == 'backup':
+            return (f"Backup written to {os.path.basename(report['path'])} "
+                    f"({report['bytes_written'] / 1048576:,.1f} MB in {seconds:.1f} s)")
+        if report['task'] == 'optimize':
+            return f"Statistics refreshed for {report['indexes_analyzed']} indexes in {seconds:.2f} s"
+        if report['mode'] == 'skipped':
+            return f"Pruned {report['changes_pruned']:,} change log entries; no space to reclaim"
+        return (f"Reclaimed {report['bytes_reclaimed'] / 1048576:,.1f} MB "
+                f"({report['mode']} vacuum) in {seconds:.1f} s")
+    
+    def _submit(self, name, fn, *args):
+        """Run a task on the executor and report the outcome on the GUI thread"""
+        return self.executor.submit(
+            fn, *args,
+            callback=self._on_task_finished,
+            error_callback=lambda error: self.task_failed.emit(name, error)
+        )
+    
+    def _on_task_finished(self, result):
+        reports = result if isinstance(result, list) else [result]
+        for report in reports:
+            self.last_reports[report['task']] = report
+            self.task_finished.emit(report)
+    
+    def _backups(self):
+        """Timestamped backups of this database, oldest first"""
+        name = os.path.splitext(os.path.basename(self.connections.db_path))[0]
+        return sorted(glob.glob(os.path.join(self.backup_dir, f"{name}-*.db")))
+    
+    def _prune_backups(self):
+        """Delete all but the newest BACKUP_KEEP timestamped backups"""
+        removed = 0
+        for path in self._backups()[:-self.BACKUP_KEEP]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
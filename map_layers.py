@@ -0,0 +1,126 @@
+import numpy as np
+
+from clustering import ClusterIndex
+from heat_tiles import HeatTileRenderer
+
+# 6 decimals is ~0.1 m, well below the accuracy of the survey coordinates
+COORDINATE_DECIMALS = 6
+
+# Most features sent for one viewport; denser views are sent as cells
+MAX_FEATURES = 5000
+
+# Cells are drawn at the finest resolution at least this many pixels wide
+MIN_CELL_PIXELS = 12
+
+def pack_points(df):
+    """Column arrays of the survey points, ready for json.dumps.
+    
+    Returns a dict of equal-length lists: id, lat, lon, population and
+    date (ISO strings, empty when missing).
+    """
+    if df.empty:
+        return {'id': [], 'lat': [], 'lon': [], 'population': [], 'date': []}
+    
+    dates = df['date_added'].to_numpy()
+    if np.issubdtype(dates.dtype, np.datetime64):
+        missing = np.isnat(dates)
+        dates = np.datetime_as_string(dates.astype('datetime64[s]'), unit='s')
+        dates[missing] = ''
+    else:
+        dates = np.where(df['date_added'].isna(), '', df['date_added'].astype(str))
+    
+    return {
+        'id': df['id'].to_numpy().tolist(),
+        'lat': np.round(df['latitude'].to_numpy(dtype=np.float64), COORDINATE_DECIMALS).tolist(),
+        'lon': np.round(df['longitude'].to_numpy(dtype=np.float64), COORDINATE_DECIMALS).tolist(),
+        'population': df['population'].to_numpy().tolist(),
+        'date': dates.tolist()
+    }
+
+def pack_cells(df, resolution):
+    """Column arrays of grid cells from DatabaseManager.aggregate_by_cell"""
+    return {
+        'lat': np.round(df['latitude'].to_numpy(dtype=np.float64), COORDINATE_DECIMALS).tolist(),
+        'lon': np.round(df['longitude'].to_numpy(dtype=np.float64), COORDINATE_DECIMALS).tolist(),
+        'count': df['count'].to_numpy().tolist(),
+        'population': df['population'].to_numpy().tolist(),
+        'size': 10.0 ** -resolution
+    }
+
+def pack_clusters(index, df):
+    """Column arrays of ClusterIndex clusters; single points carry their survey details"""
+    singles = df['point_id'].to_numpy()
+    details = index.get_points(singles[singles >= 0])
+    dates = details['date_added'].reindex(singles).fillna('').astype(str).to_numpy()
+    return {
+        'id': df['cluster_id'].to_numpy().tolist(),
+        'lat': np.round(df['latitude'].to_numpy(dtype=np.float64), COORDINATE_DECIMALS).tolist(),
+        'lon': np.round(df['longitude'].to_numpy(dtype=np.float64), COORDINATE_DECIMALS).tolist(),
+        'count': df['count'].to_numpy().tolist(),
+        'population': df['population'].to_numpy().tolist(),
+        'point_id': singles.tolist(),
+        'date': dates.tolist()
+    }
+
+def cell_resolution(zoom, resolutions):
+    """Finest cell resolution whose cells are MIN_CELL_PIXELS wide at zoom"""
+    # Web Mercator tiles are 256 pixels and span 360 / 2**zoom degrees
+    degrees_per_pixel = 360.0 / (256 * 2 ** zoom)
+    usable = [r for r in resolutions if 10.0 ** -r >= MIN_CELL_PIXELS * degrees_per_pixel]
+    return max(usable) if usable else min(resolutions)
+
+def viewport_payload(db_manager, seq, bounds, zoom, min_population=0, view='Markers'):
+    """Features to draw for a map viewport, scaled to the zoom level.
+    
+    bounds is (south, west, north, east). The Heat Map view is drawn from
+    raster tiles, so it only gets the data version the tile URLs are keyed
+    by. The Clusters view gets the clusters of the shared ClusterIndex at
+    that zoom. Otherwise the survey points in view are sent whenever there
+    are at most MAX_FEATURES of them, at any zoom, for the page to filter
+    by population itself; beyond that the points are aggregated into
+    grid cells, filtered by min_population in the query and capped at the
+    MAX_FEATURES most populous. seq is echoed so the page can drop replies
+    to viewports it has already left.
+    """
+    south, west, north, east = bounds
+    south, north = max(south, -90.0), min(north, 90.0)
+    west, east = max(west, -180.0), min(east, 180.0)
+    payload = {'seq': seq, 'zoom': zoom, 'kind': 'points', 'truncated': False}
+    
+    if view == 'Heat Map':
+        renderer = HeatTileRenderer.for_connections(db_manager.connections)
+        payload['kind'] = 'tiles'
+        payload['version'] = renderer.version()
+        empty = True
+    elif view == 'Clusters':
+        index = ClusterIndex.for_connections(db_manager.connections)
+        clusters = index.get_clusters((south, west, north, east), zoom, min_population)
+        if len(clusters) > MAX_FEATURES:
+            clusters = clusters.nlargest(MAX_FEATURES, 'count')
+            payload['truncated'] = True
+        payload['kind'] = 'clusters'
+        payload['clusters'] = pack_clusters(index, clusters)
+        empty = clusters.empty
+    elif db_manager.count_in_bbox(south, west, north, east) <= MAX_FEATURES:
+        payload['points'] = pack_points(db_manager.get_crab_data_in_bbox(south, west, north, east))
+        empty = not payload['points']['id']
+    else:
+        resolution = cell_resolution(zoom, db_manager.CELL_RESOLUTIONS)
+        cells = db_manager.aggregate_by_cell(resolution, bbox=(south, west, north, east),
+                                             min_population=min_population)
+        if len(cells) > MAX_FEATURES:
+            cells = cells.nlargest(MAX_FEATURES, 'population')
+            payload['truncated'] = True
+        payload['kind'] = 'cells'
+        payload['cells'] = pack_cells(cells, resolution)
+        empty = cells.empty
+    
+    # Tell an empty viewport apart from an empty database
+    payload['no_data'] = empty and db_manager.get_summary_stats()['total_locations'] == 0
+    return payload
+
+def children_payload(db_manager, seq, cluster_id, min_population=0):
+    """The clusters or points one zoom level in from a cluster, for drill-down"""
+    index = ClusterIndex.for_connections(db_manager.connections)
+    children = index.get_cluster_children(cluster_id, min_population)
+    return {'seq': seq, 'kind': 'clusters', 'clusters': pack_clusters(index, children)}
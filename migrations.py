@@ -0,0 +1,192 @@
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+MIGRATION_TABLE = 'schema_migrations'
+
+# Rowid checkpoint before any row has been backfilled
+FIRST_ROWID = -(2 ** 63)
+LAST_ROWID = 2 ** 63 - 1
+
+def backfill_limit(version):
+    """SQL for the last rowid the backfill of a migration has processed.
+    
+    Triggers that keep totals the backfill is still seeding count only the
+    rows up to here, and leave the rest to the backfill. Once the migration
+    has finished every rowid is below it.
+    """
+    return (f"COALESCE((SELECT checkpoint FROM {MIGRATION_TABLE} "
+            f"WHERE version = {int(version)} AND finished_at IS NULL), {LAST_ROWID})")
+
+class Migration:
+    """One numbered schema change.
+    
+    schema(cursor) runs in a single transaction and must be idempotent
+    (IF NOT EXISTS), since an interrupted migration runs it again. The
+    optional backfill(conn, low, high) updates the rows of backfill_table
+    whose rowid is in (low, high] and returns the number of rows written.
+    """
+    def __init__(self, version, name, schema, backfill_table=None, backfill=None):
+        self.version = version
+        self.name = name
+        self.schema = schema
+        self.backfill_table = backfill_table
+        self.backfill = backfill
+
+class MigrationRunner:
+    """Brings a database up to date, tracked with PRAGMA user_version.
+    
+    user_version is the last fully applied migration. The schema_migrations
+    table keeps the timing of each step and, for backfills, a rowid
+    checkpoint: the rows are processed in rowid order in short
+    transactions, so other writers only ever wait for one batch, and an
+    interrupted backfill resumes after the last committed batch. Batch
+    sizes adapt to take about TARGET_BATCH_SECONDS each.
+    """
+    BATCH_SIZE = 20000
+    MIN_BATCH_SIZE = 1000
+    MAX_BATCH_SIZE = 500000
+    TARGET_BATCH_SECONDS = 0.2
+    
+    # Pause between batches so queued writers get the lock
+    BATCH_PAUSE = 0.01
+    
+    # Wait before trying again when another writer kept the database locked
+    LOCKED_RETRY_SECONDS = 1.0
+    
+    def __init__(self, connections, migrations, error_callback=None):
+        self.connections = connections
+        self.migrations = sorted(migrations, key=lambda migration: migration.version)
+        self.error_callback = error_callback
+        self.thread = None
+    
+    def run(self, background=False):
+        """Apply every pending migration.
+        
+        With background, the schema changes up to the first pending
+        backfill are applied right away, and that backfill and everything
+        after it continue on a daemon thread.
+        """
+        with self.connections.writer() as conn:
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {MIGRATION_TABLE} (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TEXT,
+                    schema_seconds REAL,
+                    backfill_seconds REAL NOT NULL DEFAULT 0,
+                    batches INTEGER NOT NULL DEFAULT 0,
+                    rows_backfilled INTEGER NOT NULL DEFAULT 0,
+                    checkpoint INTEGER NOT NULL DEFAULT {FIRST_ROWID}
+                )
+            ''')
+        
+        for index, migration in enumerate(self.migrations):
+            if not self._apply_schema(migration) or migration.backfill is None:
+                continue
+            
+            if background:
+                self.thread = threading.Thread(
+                    target=self._run_remaining, args=(self.migrations[index:],), daemon=True
+                )
+                self.thread.start()
+                return
+            self._run_backfill(migration)
+    
+    def version(self):
+        """Return the last fully applied migration"""
+        with self.connections.writer() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+    
+    def history(self):
+        """Timings and progress of every migration that has started"""
+        with self.connections.reader() as conn:
+            return pd.read_sql_query(f"SELECT * FROM {MIGRATION_TABLE} ORDER BY version", conn)
+    
+    def _run_remaining(self, migrations):
+        """Finish the pending migrations on the background thread"""
+        try:
+            for migration in migrations:
+                while True:
+                    try:
+                        if self._apply_schema(migration) and migration.backfill is not None:
+                            self._run_backfill(migration)
+                        break
+                    except sqlite3.OperationalError as e:
+                        # Both steps resume where they stopped, so a long
+                        # import only delays the migration
+                        if 'locked' not in str(e) and 'busy' not in str(e):
+                            raise
+                        time.sleep(self.LOCKED_RETRY_SECONDS)
+        except Exception as e:
+            if self.error_callback is not None:
+                self.error_callback(f"Database migration error: {str(e)}")
+    
+    def _apply_schema(self, migration):
+        """Run the schema step unless done; returns True while the migration is incomplete"""
+        with self.connections.writer() as conn:
+            # Checked inside the write transaction, so concurrent processes
+            # never run the same step twice
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= migration.version:
+                return False
+            
+            state = conn.execute(f"SELECT schema_seconds FROM {MIGRATION_TABLE} WHERE version = ?",
+                                 (migration.version,)).fetchone()
+            if state is not None and state[0] is not None:
+                return True
+            
+            started = time.perf_counter()
+            migration.schema(conn.cursor())
+            conn.execute(f'''
+                INSERT OR REPLACE INTO {MIGRATION_TABLE} (version, name, schema_seconds)
+                VALUES (?, ?, ?)
+            ''', (migration.version, migration.name, time.perf_counter() - started))
+            
+            if migration.backfill is None:
+                self._mark_done(conn, migration)
+                return False
+            return True
+    
+    def _run_backfill(self, migration):
+        """Backfill in rowid batches, committing the checkpoint with each batch"""
+        batch_size = self.BATCH_SIZE
+        while True:
+            with self.connections.writer() as conn:
+                started = time.perf_counter()
+                checkpoint = conn.execute(f"SELECT checkpoint FROM {MIGRATION_TABLE} WHERE version = ?",
+                                          (migration.version,)).fetchone()[0]
+                high = conn.execute(f'''
+                    SELECT MAX(rowid) FROM (
+                        SELECT rowid FROM {migration.backfill_table}
+                        WHERE rowid > ? ORDER BY rowid LIMIT ?
+                    )
+                ''', (checkpoint, batch_size)).fetchone()[0]
+                
+                if high is None:
+                    self._mark_done(conn, migration)
+                    return
+                
+                rows = migration.backfill(conn, checkpoint, high)
+                elapsed = time.perf_counter() - started
+                conn.execute(f'''
+                    UPDATE {MIGRATION_TABLE} SET
+                        checkpoint = ?,
+                        batches = batches + 1,
+                        rows_backfilled = rows_backfilled + ?,
+                        backfill_seconds = backfill_seconds + ?
+                    WHERE version = ?
+                ''', (high, rows or 0, elapsed, migration.version))
+            
+            # Aim the next batch at the target transaction length
+            scale = self.TARGET_BATCH_SECONDS / max(elapsed, 0.001)
+            batch_size = int(min(max(batch_size * min(scale, 2.0), self.MIN_BATCH_SIZE),
+                                 self.MAX_BATCH_SIZE))
+            time.sleep(self.BATCH_PAUSE)
+    
+    def _mark_done(self, conn, migration):
+        conn.execute(f"UPDATE {MIGRATION_TABLE} SET finished_at = CURRENT_TIMESTAMP WHERE version = ?",
+                     (migration.version,))
+        conn.execute(f"PRAGMA user_version = {int(migration.version)}")
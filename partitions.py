@@ -0,0 +1,309 @@
+import os
+import pathlib
+import re
+import sqlite3
+
+import pandas as pd
+
+PARTITION_TABLE = 'crab_population_partitions'
+
+PARTITION_SCHEMA = [
+    f'''
+    CREATE TABLE IF NOT EXISTS {PARTITION_TABLE} (
+        name TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        start_date TEXT NOT NULL,
+        end_date TEXT NOT NULL,
+        row_count INTEGER NOT NULL,
+        population_sum INTEGER NOT NULL,
+        population_sum_sq REAL NOT NULL,
+        population_max INTEGER,
+        archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    '''
+]
+
+# Every archived ID and its archive; IDs stay unique across the live table
+# and the archives, so an insert of an archived ID is rejected
+ARCHIVED_ID_TABLE = 'crab_population_archived_ids'
+
+ARCHIVED_ID_SCHEMA = [
+    f'''
+    CREATE TABLE IF NOT EXISTS {ARCHIVED_ID_TABLE} (
+        id INTEGER PRIMARY KEY,
+        partition_name TEXT NOT NULL
+    )
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS crab_population_archived_id_insert
+    BEFORE INSERT ON crab_population
+    WHEN EXISTS (SELECT 1 FROM {ARCHIVED_ID_TABLE} WHERE id = NEW.id)
+    BEGIN
+        SELECT RAISE(ABORT, 'ID belongs to an archived season');
+    END
+    '''
+]
+
+# Same layout as the live table, so archived rows read back unchanged
+PARTITION_TABLE_SCHEMA = '''
+    CREATE TABLE crab_population (
+        id INTEGER PRIMARY KEY,
+        population INTEGER NOT NULL,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        date_added TEXT
+    )
+'''
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+class PartitionError(Exception):
+    """Raised when a season cannot be archived"""
+
+def format_timestamp(value):
+    """Format a date, timestamp or string the way date_added is stored"""
+    return pd.Timestamp(value).strftime(TIMESTAMP_FORMAT)
+
+class PartitionManager:
+    """Read-only per-season archives of crab_population.
+    
+    Each archived season is its own SQLite file under data/partitions,
+    holding the rows whose date_added falls in [start_date, end_date). The
+    live table keeps only the current rows; a registry table in the main
+    database records every archive with its date range and population
+    totals, and every archived ID so it cannot be reused. Range queries
+    ATTACH just the archives that overlap the requested dates (read-only
+    and immutable, so without locking) and combine them with the live
+    table through UNION ALL.
+    """
+    
+    def __init__(self, connections, rollups=()):
+        self.connections = connections
+        
+        # (table, SQL bucket expression) of each rollup kept across archives
+        self.rollups = list(rollups)
+        self.directory = os.path.join(os.path.dirname(connections.db_path), 'partitions')
+    
+    def list(self, conn, start=None, end=None):
+        """Registry rows of the archives overlapping [start, end), oldest first"""
+        query = f"SELECT * FROM {PARTITION_TABLE}"
+        
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append("end_date > ?")
+            params.append(format_timestamp(start))
+        if end is not None:
+            conditions.append("start_date < ?")
+            params.append(format_timestamp(end))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY start_date"
+        
+        return pd.read_sql_query(query, conn, params=params)
+    
+    def attach_limit(self, conn):
+        """How many archives one query can reach on this connection"""
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    
+    def attach(self, conn, names):
+        """Make the named archives available on a connection.
+        
+        Attachments stay on the pooled connection between queries; archives
+        not in names are detached only when the connection runs out of slots.
+        """
+        attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+        missing = [name for name in names if name not in attached]
+        if not missing:
+            return
+        
+        spare = self.attach_limit(conn) - (len(attached) - 2)
+        for name in attached - {'main', 'temp'} - set(names):
+            if spare >= len(missing):
+                break
+            conn.execute(f'DETACH DATABASE "{name}"')
+            spare += 1
+        
+        paths = dict(conn.execute(
+            f"SELECT name, path FROM {PARTITION_TABLE} WHERE name IN ({','.join('?' * len(missing))})",
+            missing
+        ).fetchall())
+        for name in missing:
+            uri = pathlib.Path(self._resolve(paths[name])).as_uri() + '?mode=ro&immutable=1'
+            conn.execute("ATTACH DATABASE ? AS " + f'"{name}"', (uri,))
+    
+    def backfill_archived_ids(self, conn, low, high):
+        """Record the IDs of the archives whose registry rowid is in (low, high].
+        
+        For archives made before the ID registry existed. The files are read
+        through their own connections, since ATTACH is not possible inside
+        the write transaction.
+        """
+        archives = conn.execute(f"SELECT name, path FROM {PARTITION_TABLE} WHERE rowid > ? AND rowid <= ?",
+                                (low, high)).fetchall()
+        
+        recorded = 0
+        for name, path in archives:
+            uri = pathlib.Path(self._resolve(path)).as_uri() + '?mode=ro&immutable=1'
+            archive = sqlite3.connect(uri, uri=True)
+            try:
+                ids = archive.execute("SELECT id FROM crab_population")
+                recorded += conn.executemany(
+                    f"INSERT OR IGNORE INTO {ARCHIVED_ID_TABLE} (id, partition_name) VALUES (?, ?)",
+                    ((row[0], name) for row in ids)
+                ).rowcount
+            finally:
+                archive.close()
+        return recorded
+    
+    def union_query(self, names, select, where='', include_live=True):
+        """Build one SELECT over the live table and the named archives"""
+        sources = (['main'] if include_live else []) + list(names)
+        return '\nUNION ALL\n'.join(
+            f'SELECT {select} FROM "{schema}".crab_population {where}' for schema in sources
+        )
+    
+    def archive(self, name, start, end):
+        """Move the rows dated in [start, end) into a new archive file.
+        
+        The archive is written and synced from a read snapshot first; the
+        rows are then deleted from the live table and the archive is
+        registered in one write transaction, which fails if rows in the
+        range changed in between. Returns the number of rows archived.
+        """
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', name) or name in ('main', 'temp'):
+            raise PartitionError(f"Invalid partition name: {name}")
+        
+        start, end = format_timestamp(start), format_timestamp(end)
+        if start >= end:
+            raise PartitionError("Partition range is empty")
+        
+        with self.connections.reader() as conn:
+            if not self.list(conn, start, end).empty:
+                raise PartitionError(f"Range {start} to {end} overlaps an existing partition")
+            if conn.execute(f"SELECT 1 FROM {PARTITION_TABLE} WHERE name = ?", (name,)).fetchone():
+                raise PartitionError(f"Partition {name} already exists")
+        
+        os.makedirs(self.directory, exist_ok=True)
+        relative_path = os.path.join('partitions', f'{name}.db')
+        path = self._resolve(relative_path)
+        if os.path.exists(path):
+            raise PartitionError(f"Partition file already exists: {path}")
+        
+        copied = self._write_archive(path, start, end)
+        
+        try:
+            self._register(name, relative_path, start, end, copied)
+        except BaseException:
+            os.remove(path)
+            raise
+        
+        return copied[0]
+    
+    def _resolve(self, relative_path):
+        """Absolute path of an archive stored relative to the main database"""
+        return os.path.join(os.path.dirname(self.connections.db_path), relative_path)
+    
+    def _write_archive(self, path, start, end):
+        """Copy the rows in range into a fresh archive file and return their totals"""
+        tmp_path = path + '.tmp'
+        source = pathlib.Path(self.connections.db_path).as_uri() + '?mode=ro'
+        
+        conn = sqlite3.connect(tmp_path, isolation_level=None, uri=True)
+        try:
+            # The file is written once and never modified afterwards
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA page_size = 8192")
+            conn.execute("ATTACH DATABASE ? AS source", (source,))
+            
+            conn.execute("BEGIN")
+            conn.execute(PARTITION_TABLE_SCHEMA)
+            conn.execute('''
+                INSERT INTO crab_population
+                SELECT id, population, latitude, longitude, date_added
+                FROM source.crab_population
+                WHERE date_added >= ? AND date_added < ?
+                ORDER BY id
+            ''', (start, end))
+            conn.execute("CREATE INDEX idx_crab_population_date_added ON crab_population (date_added)")
+            totals = conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(population), 0),
+                       COALESCE(SUM(1.0 * population * population), 0), MAX(population)
+                FROM crab_population
+            ''').fetchone()
+            conn.execute("COMMIT")
+            
+            conn.execute("DETACH DATABASE source")
+            conn.execute("ANALYZE")
+        except BaseException:
+            conn.close()
+            os.remove(tmp_path)
+            raise
+        conn.close()
+        
+        if not totals[0]:
+            os.remove(tmp_path)
+            raise PartitionError(f"No rows dated between {start} and {end}")
+        
+        with open(tmp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return totals
+    
+    def _register(self, name, relative_path, start, end, totals):
+        """Delete the archived rows from the live table and record the archive"""
+        with self.connections.writer() as conn:
+            count = conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(population), 0)
+                FROM crab_population WHERE date_added >= ? AND date_added < ?
+            ''', (start, end)).fetchone()
+            if tuple(count) != tuple(totals[:2]):
+                raise PartitionError("Rows in the range changed while archiving; try again")
+            
+            # Archived days and months stay in the rollups, so keep their
+            # totals aside and add them back after the delete triggers ran
+            for table, bucket in self.rollups:
+                period = bucket.format("date_added")
+                conn.execute(f"DROP TABLE IF EXISTS temp.archived_{table}")
+                conn.execute(f'''
+                    CREATE TEMP TABLE archived_{table} AS
+                    SELECT {period} AS period, COUNT(*) AS row_count, SUM(population) AS population_sum
+                    FROM crab_population
+                    WHERE date_added >= ? AND date_added < ? AND {period} IS NOT NULL
+                    GROUP BY 1
+                ''', (start, end))
+            
+            conn.execute(f'''
+                INSERT INTO {ARCHIVED_ID_TABLE} (id, partition_name)
+                SELECT id, ? FROM crab_population WHERE date_added >= ? AND date_added < ?
+            ''', (name, start, end))
+            
+            # Archived rows stay in the per-site history; with source_id
+            # cleared the observation delete trigger leaves them alone
+            conn.execute('''
+                UPDATE observations SET source_id = NULL
+                WHERE source_id IN (
+                    SELECT id FROM crab_population WHERE date_added >= ? AND date_added < ?
+                )
+            ''', (start, end))
+            
+            conn.execute("DELETE FROM crab_population WHERE date_added >= ? AND date_added < ?",
+                         (start, end))
+            
+            for table, _ in self.rollups:
+                # WHERE true disambiguates ON CONFLICT from a join constraint
+                conn.execute(f'''
+                    INSERT INTO {table} (period, row_count, population_sum)
+                    SELECT period, row_count, population_sum FROM temp.archived_{table} WHERE true
+                    ON CONFLICT (period) DO UPDATE SET
+                        row_count = row_count + excluded.row_count,
+                        population_sum = population_sum + excluded.population_sum
+                ''')
+                conn.execute(f"DROP TABLE temp.archived_{table}")
+            
+            conn.execute(f'''
+                INSERT INTO {PARTITION_TABLE}
+                    (name, path, start_date, end_date, row_count,
+                     population_sum, population_sum_sq, population_max)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (name, relative_path, start, end) + tuple(totals))
@@ -0,0 +1,163 @@
+import itertools
+import threading
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+class QueryFuture:
+    """Handle for a query submitted to the QueryExecutor.
+    
+    Callbacks run on the GUI thread. A cancelled future never runs its
+    callbacks, even if the query itself already finished.
+    """
+    def __init__(self, channel=None):
+        self.channel = channel
+        self.cancelled = False
+        self.finished = False
+        self.result = None
+        self.error = None
+        self._callbacks = []
+        self._error_callbacks = []
+    
+    def add_done_callback(self, callback):
+        self._callbacks.append(callback)
+        if self.finished and self.error is None and not self.cancelled:
+            callback(self.result)
+    
+    def add_error_callback(self, callback):
+        self._error_callbacks.append(callback)
+        if self.finished and self.error is not None and not self.cancelled:
+            callback(self.error)
+    
+    def cancel(self):
+        """Drop the result of this query"""
+        self.cancelled = True
+    
+    def _resolve(self, result, error):
+        self.finished = True
+        self.result = result
+        self.error = error
+        if self.cancelled:
+            return
+        
+        callbacks = self._callbacks if error is None else self._error_callbacks
+        for callback in callbacks:
+            callback(result if error is None else error)
+
+class _QueryTask(QRunnable):
+    """Runs one query on a pool thread and reports back to the executor"""
+    def __init__(self, executor, task_id, fn, args, kwargs):
+        super().__init__()
+        self.executor = executor
+        self.task_id = task_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.futures = []
+    
+    def run(self):
+        # Skip the work entirely if every caller lost interest before it started
+        if all(future.cancelled for future in self.futures):
+            self.executor._task_done.emit(self.task_id, None, None)
+            return
+        
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+            self.executor._task_done.emit(self.task_id, result, None)
+        except Exception as e:
+            self.executor._task_done.emit(self.task_id, None, str(e))
+
+class QueryExecutor(QObject):
+    """Runs database calls on a thread pool so the GUI thread never blocks.
+    
+    Submitting to a channel supersedes (cancels) the previous request on
+    that channel, e.g. the last chart refresh when the chart type changes
+    again. Identical requests that are still in flight are coalesced into
+    a single query.
+    """
+    # Delivered from pool threads and received on the executor's thread
+    _task_done = pyqtSignal(int, object, object)
+    
+    _instance = None
+    
+    @classmethod
+    def instance(cls):
+        """Return the shared query executor"""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+    
+    # Fewer than ConnectionManager.READER_POOL_SIZE, so other threads still
+    # find a free reader while every query thread holds one
+    MAX_THREADS = 4
+    
+    def __init__(self, max_threads=MAX_THREADS):
+        super().__init__()
+        
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_threads)
+        
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._in_flight = {}
+        self._channels = {}
+        
+        self._task_done.connect(self._on_task_done)
+    
+    def submit(self, fn, *args, channel=None, callback=None, error_callback=None, **kwargs):
+        """Run fn(*args, **kwargs) in the background and return a QueryFuture"""
+        future = QueryFuture(channel)
+        if callback is not None:
+            future.add_done_callback(callback)
+        if error_callback is not None:
+            future.add_error_callback(error_callback)
+        
+        if channel is not None:
+            previous = self._channels.get(channel)
+            if previous is not None:
+                previous.cancel()
+            self._channels[channel] = future
+        
+        key = self._coalesce_key(fn, args, kwargs)
+        with self._lock:
+            task = self._in_flight.get(key) if key is not None else None
+            if task is not None:
+                task.futures.append(future)
+                return future
+            
+            task = _QueryTask(self, next(self._ids), fn, args, kwargs)
+            task.setAutoDelete(False)
+            task.futures.append(future)
+            self._tasks[task.task_id] = (task, key)
+            if key is not None:
+                self._in_flight[key] = task
+        
+        self.pool.start(task)
+        return future
+    
+    def cancel_channel(self, channel):
+        """Cancel the pending request on a channel"""
+        future = self._channels.pop(channel, None)
+        if future is not None:
+            future.cancel()
+    
+    def _coalesce_key(self, fn, args, kwargs):
+        """Key identifying identical requests, or None if arguments are unhashable"""
+        try:
+            key = (getattr(fn, '__self__', None), getattr(fn, '__func__', fn),
+                   args, frozenset(kwargs.items()))
+            hash(key)
+            return key
+        except TypeError:
+            return None
+    
+    def _on_task_done(self, task_id, result, error):
+        with self._lock:
+            task, key = self._tasks.pop(task_id)
+            if key is not None and self._in_flight.get(key) is task:
+                del self._in_flight[key]
+        
+        for future in task.futures:
+            if self._channels.get(future.channel) is future:
+                del self._channels[future.channel]
+            future._resolve(result, error)
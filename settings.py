@@ -5,14 +5,20 @@ from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel,
 from PyQt5.QtCore import Qt, QSettings
 from PyQt5.QtGui import QColor
 
-from database import DatabaseManager
+from maintenance import MaintenanceService
+from settings_service import SettingsService
 
 class SettingsWidget(QWidget):
     def __init__(self):
         super().__init__()
         
-        # Initialize database manager
-        self.db_manager = DatabaseManager()
+        # Shared in-memory settings
+        self.settings = SettingsService.instance()
+        
+        # Background database backups and maintenance
+        self.maintenance = MaintenanceService.instance()
+        self.maintenance.task_finished.connect(self.on_maintenance_finished)
+        self.maintenance.task_failed.connect(self.on_maintenance_failed)
         
         # Create layout
         layout = QVBoxLayout(self)
@@ -271,6 +277,31 @@ class SettingsWidget(QWidget):
         """)
         app_layout.addRow(splash_label, self.splash_check)
         
+        # Database backup
+        backup_label = QLabel("Database Backup:")
+        self.backup_btn = QPushButton("Back Up Now")
+        self.backup_btn.clicked.connect(self.backup_database)
+        self.backup_btn.setStyleSheet("""
+            QPushButton {
+                background-color: rgba(255, 255, 255, 0.1);
+                color: white;
+                border: 1px solid rgba(255, 255, 255, 0.2);
+                border-radius: 5px;
+                padding: 8px;
+            }
+            
+            QPushButton:hover {
+                background-color: rgba(255, 255, 255, 0.2);
+            }
+        """)
+        app_layout.addRow(backup_label, self.backup_btn)
+        
+        # Last maintenance report
+        self.maintenance_status = QLabel("")
+        self.maintenance_status.setWordWrap(True)
+        self.maintenance_status.setStyleSheet("color: rgba(255, 255, 255, 0.7);")
+        app_layout.addRow("", self.maintenance_status)
+        
         settings_layout.addWidget(app_group)
         
         # Add buttons
@@ -334,26 +365,44 @@ class SettingsWidget(QWidget):
                 min-height: 30px;
             """)
     
+    def backup_database(self):
+        """Start an online backup of the database"""
+        self.backup_btn.setEnabled(False)
+        self.maintenance_status.setText("Backing up...")
+        self.maintenance.run_backup()
+    
+    def on_maintenance_finished(self, report):
+        """Show the result of a maintenance task"""
+        if report['task'] == 'backup':
+            self.backup_btn.setEnabled(True)
+        self.maintenance_status.setText(MaintenanceService.describe(report))
+    
+    def on_maintenance_failed(self, task, error):
+        """Show a failed maintenance task"""
+        if task == 'backup':
+            self.backup_btn.setEnabled(True)
+        self.maintenance_status.setText(f"Maintenance ({task}) failed: {error}")
+    
     def load_settings(self):
-        """Load settings from database"""
+        """Load settings from the settings service"""
         # Theme
-        theme = self.db_manager.get_setting('theme', 'dark')
+        theme = self.settings.get('theme')
         index = self.theme_combo.findText(theme.title(), Qt.MatchContains)
         if index >= 0:
             self.theme_combo.setCurrentIndex(index)
         
         # Map style
-        map_style = self.db_manager.get_setting('map_style', 'dark')
+        map_style = self.settings.get('map_style')
         index = self.map_combo.findText(map_style.title(), Qt.MatchContains)
         if index >= 0:
             self.map_combo.setCurrentIndex(index)
         
         # Font size
-        font_size = int(self.db_manager.get_setting('font_size', '12'))
+        font_size = self.settings.get('font_size')
         self.font_spin.setValue(font_size)
         
         # Accent color
-        accent_color = self.db_manager.get_setting('accent_color', '#0066cc')
+        accent_color = self.settings.get('accent_color')
         self.accent_btn.setStyleSheet(f"""
             background-color: {accent_color};
             border: 1px solid rgba(255, 255, 255, 0.2);
@@ -362,66 +411,53 @@ class SettingsWidget(QWidget):
         """)
         
         # Zoom level
-        zoom_level = int(self.db_manager.get_setting('zoom_level', '10'))
+        zoom_level = self.settings.get('zoom_level')
         self.zoom_slider.setValue(zoom_level)
         
         # Show labels
-        show_labels = self.db_manager.get_setting('show_labels', 'true') == 'true'
+        show_labels = self.settings.get('show_labels')
         self.labels_check.setChecked(show_labels)
         
         # Default view
-        default_view = self.db_manager.get_setting('default_view', 'Markers')
+        default_view = self.settings.get('default_view')
         index = self.view_combo.findText(default_view, Qt.MatchExactly)
         if index >= 0:
             self.view_combo.setCurrentIndex(index)
         
         # Default page
-        default_page = self.db_manager.get_setting('default_page', 'Dashboard')
+        default_page = self.settings.get('default_page')
         index = self.page_combo.findText(default_page, Qt.MatchExactly)
         if index >= 0:
             self.page_combo.setCurrentIndex(index)
         
         # Refresh interval
-        refresh_interval = int(self.db_manager.get_setting('refresh_interval', '5'))
+        refresh_interval = self.settings.get('refresh_interval')
         self.refresh_spin.setValue(refresh_interval)
         
         # Show splash
-        show_splash = self.db_manager.get_setting('show_splash', 'true') == 'true'
+        show_splash = self.settings.get('show_splash')
         self.splash_check.setChecked(show_splash)
     
     def save_settings(self):
         """Save settings to database"""
         try:
-            # Theme
-            self.db_manager.set_setting('theme', self.theme_combo.currentText().lower())
-            
-            # Map style
-            self.db_manager.set_setting('map_style', self.map_combo.currentText().lower())
-            
-            # Font size
-            self.db_manager.set_setting('font_size', str(self.font_spin.value()))
-            
-            # Accent color
-            accent_color = self.accent_btn.palette().button().color().name()
-            self.db_manager.set_setting('accent_color', accent_color)
-            
-            # Zoom level
-            self.db_manager.set_setting('zoom_level', str(self.zoom_slider.value()))
-            
-            # Show labels
-            self.db_manager.set_setting('show_labels', str(self.labels_check.isChecked()).lower())
-            
-            # Default view
-            self.db_manager.set_setting('default_view', self.view_combo.currentText())
-            
-            # Default page
-            self.db_manager.set_setting('default_page', self.page_combo.currentText())
-            
-            # Refresh interval
-            self.db_manager.set_setting('refresh_interval', str(self.refresh_spin.value()))
+            values = {
+                'theme': self.theme_combo.currentText().lower(),
+                'map_style': self.map_combo.currentText().lower(),
+                'font_size': self.font_spin.value(),
+                'accent_color': self.accent_btn.palette().button().color().name(),
+                'zoom_level': self.zoom_slider.value(),
+                'show_labels': self.labels_check.isChecked(),
+                'default_view': self.view_combo.currentText(),
+                'default_page': self.page_combo.currentText(),
+                'refresh_interval': self.refresh_spin.value(),
+                'show_splash': self.splash_check.isChecked()
+            }
             
-            # Show splash
-            self.db_manager.set_setting('show_splash', str(self.splash_check.isChecked()).lower())
+            # Write everything in one transaction
+            if not self.settings.set_many(values):
+                self.show_error("Error saving settings.")
+                return
             
             # Show success message
             self.show_success("Settings saved successfully! Restart the application for changes to take effect.")
@@ -454,23 +490,8 @@ class SettingsWidget(QWidget):
         
         if confirm.exec_() == QMessageBox.Yes:
             try:
-                # Reset to defaults
-                default_settings = {
-                    'theme': 'dark',
-                    'map_style': 'dark',
-                    'font_size': '12',
-                    'accent_color': '#0066cc',
-                    'zoom_level': '10',
-                    'show_labels': 'true',
-                    'default_view': 'Markers',
-                    'default_page': 'Dashboard',
-                    'refresh_interval': '5',
-                    'show_splash': 'true'
-                }
-                
-                # Save defaults to database
-                for key, value in default_settings.items():
-                    self.db_manager.set_setting(key, value)
+                # Reset to defaults in one transaction
+                self.settings.reset_to_defaults()
                 
                 # Reload settings
                 self.load_settings()
@@ -0,0 +1,125 @@
+from PyQt5.QtCore import QCoreApplication, QObject, QTimer, pyqtSignal
+
+from database import DatabaseManager
+
+class SettingsService(QObject):
+    """Process-wide, typed in-memory view of the settings table.
+    
+    The whole table is read in one query at startup and reads are served
+    from memory. set() is write-behind: changes are collected and written
+    in one transaction shortly afterwards; set_many() writes immediately.
+    """
+    settings_changed = pyqtSignal(list)
+    
+    # Known settings and their defaults; the default's type is the setting's type
+    DEFAULTS = {
+        'theme': 'dark',
+        'map_style': 'dark',
+        'font_size': 12,
+        'accent_color': '#0066cc',
+        'zoom_level': 10,
+        'show_labels': True,
+        'default_view': 'Markers',
+        'default_page': 'Dashboard',
+        'refresh_interval': 5,
+        'show_splash': True
+    }
+    
+    WRITE_DELAY_MS = 250
+    
+    _instance = None
+    
+    @classmethod
+    def instance(cls):
+        """Return the shared settings service"""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+    
+    def __init__(self, db_manager=None):
+        super().__init__()
+        
+        self.db_manager = db_manager or DatabaseManager()
+        self._values = {}
+        self._pending = {}
+        
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.timeout.connect(self.flush)
+        
+        # Don't lose write-behind changes on exit
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.flush)
+        
+        self.reload()
+    
+    def reload(self):
+        """Re-read every setting from the database"""
+        stored = self.db_manager.get_all_settings()
+        self._values = {key: self._parse(key, value) for key, value in stored.items()}
+    
+    def get(self, key, default=None):
+        """Get a typed setting value"""
+        if key in self._values:
+            return self._values[key]
+        if default is not None:
+            return default
+        return self.DEFAULTS.get(key)
+    
+    def set(self, key, value):
+        """Set a setting in memory and schedule the database write"""
+        if self._values.get(key) == value:
+            return
+        
+        self._values[key] = value
+        self._pending[key] = value
+        self._flush_timer.start(self.WRITE_DELAY_MS)
+        self.settings_changed.emit([key])
+    
+    def set_many(self, values):
+        """Set several settings and write them in one transaction"""
+        changed = [key for key, value in values.items() if self._values.get(key) != value]
+        
+        self._values.update(values)
+        self._pending.update(values)
+        success = self.flush()
+        
+        if changed:
+            self.settings_changed.emit(changed)
+        return success
+    
+    def reset_to_defaults(self):
+        """Restore every known setting to its default"""
+        return self.set_many(dict(self.DEFAULTS))
+    
+    def flush(self):
+        """Write all pending changes in one transaction"""
+        self._flush_timer.stop()
+        if not self._pending:
+            return True
+        
+        pending = {key: self._format(value) for key, value in self._pending.items()}
+        if not self.db_manager.set_settings(pending):
+            return False
+        
+        self._pending.clear()
+        return True
+    
+    def _parse(self, key, value):
+        """Convert a stored string to the type of the setting's default"""
+        default = self.DEFAULTS.get(key)
+        try:
+            if isinstance(default, bool):
+                return value == 'true'
+            if isinstance(default, int):
+                return int(value)
+        except ValueError:
+            return default
+        return value
+    
+    def _format(self, value):
+        """Convert a setting value to its stored string"""
+        if isinstance(value, bool):
+            return str(value).lower()
+        return str(value)
@@ -1,8 +1,10 @@
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, 
                             QFileDialog, QLineEdit, QFormLayout, QMessageBox, 
-                            QTabWidget, QFrame, QSpinBox, QDoubleSpinBox)
-from PyQt5.QtCore import Qt, pyqtSlot
+                            QTabWidget, QFrame, QSpinBox, QDoubleSpinBox,
+                            QProgressBar, QCheckBox)
+from PyQt5.QtCore import Qt, QThread, pyqtSlot
 
+from csv_importer import CsvImporter
 from database import DatabaseManager
 
 class UploadDataWidget(QWidget):
@@ -12,6 +14,10 @@ class UploadDataWidget(QWidget):
         # Initialize database manager
         self.db_manager = DatabaseManager()
         
+        # Background CSV import state
+        self.importer = None
+        self.import_thread = None
+        
         # Create layout
         layout = QVBoxLayout(self)
         layout.setContentsMargins(20, 20, 20, 20)
@@ -53,7 +59,7 @@ class UploadDataWidget(QWidget):
         csv_layout = QVBoxLayout(csv_tab)
         
         # CSV upload instructions
-        instructions = QLabel("Upload a CSV file with the following columns: ID, Population, Latitude, Longitude")
+        instructions = QLabel("Upload a CSV file with the following columns: ID, Population, Latitude, Longitude, and optionally Date (survey date)")
         instructions.setStyleSheet("color: white; margin-bottom: 15px;")
         csv_layout.addWidget(instructions)
         
@@ -73,10 +79,15 @@ class UploadDataWidget(QWidget):
         
         csv_layout.addWidget(file_frame)
         
+        # Merge mode
+        self.merge_check = QCheckBox("Update rows whose ID already exists (merge)")
+        self.merge_check.setStyleSheet("color: white;")
+        csv_layout.addWidget(self.merge_check)
+        
         # Upload button
-        upload_btn = QPushButton("Upload CSV")
-        upload_btn.clicked.connect(self.upload_csv)
-        upload_btn.setStyleSheet("""
+        self.upload_btn = QPushButton("Upload CSV")
+        self.upload_btn.clicked.connect(self.upload_csv)
+        self.upload_btn.setStyleSheet("""
             QPushButton {
                 background-color: rgba(0, 102, 204, 0.7);
                 color: white;
@@ -91,7 +102,43 @@ class UploadDataWidget(QWidget):
             }
         """)
         
-        csv_layout.addWidget(upload_btn)
+        csv_layout.addWidget(self.upload_btn)
+        
+        # Import progress
+        progress_frame = QFrame()
+        progress_layout = QHBoxLayout(progress_frame)
+        
+        self.import_progress = QProgressBar()
+        self.import_progress.setRange(0, 0)
+        self.import_progress.setTextVisible(False)
+        self.import_progress.setStyleSheet("""
+            QProgressBar {
+                background-color: rgba(255, 255, 255, 0.1);
+                border: 1px solid rgba(255, 255, 255, 0.2);
+                border-radius: 5px;
+                height: 8px;
+            }
+            
+            QProgressBar::chunk {
+                background-color: rgba(0, 102, 204, 0.7);
+                border-radius: 5px;
+            }
+        """)
+        
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.clicked.connect(self.cancel_import)
+        
+        progress_layout.addWidget(self.import_progress)
+        progress_layout.addWidget(self.cancel_btn)
+        
+        self.import_status = QLabel("")
+        self.import_status.setStyleSheet("color: rgba(255, 255, 255, 0.7);")
+        
+        progress_frame.setVisible(False)
+        self.progress_frame = progress_frame
+        
+        csv_layout.addWidget(progress_frame)
+        csv_layout.addWidget(self.import_status)
         csv_layout.addStretch()
         
         # Create manual entry tab
@@ -207,14 +254,61 @@ class UploadDataWidget(QWidget):
             self.show_error("Please select a CSV file first.")
             return
         
-        # Import CSV
-        success = self.db_manager.import_csv(file_path)
+        if self.import_thread is not None:
+            return
+        
+        # Stream the import on a worker thread so the window stays responsive
+        mode = 'merge' if self.merge_check.isChecked() else 'append'
+        self.importer = CsvImporter(self.db_manager, file_path, mode=mode)
+        self.import_thread = QThread()
+        self.importer.moveToThread(self.import_thread)
+        
+        self.import_thread.started.connect(self.importer.run)
+        self.importer.progress.connect(self.on_import_progress)
+        self.importer.finished.connect(self.on_import_finished)
+        self.importer.finished.connect(self.import_thread.quit)
+        self.import_thread.finished.connect(self.on_import_thread_finished)
+        
+        self.upload_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(True)
+        self.progress_frame.setVisible(True)
+        self.import_status.setText("Importing...")
+        
+        self.import_thread.start()
+    
+    def cancel_import(self):
+        """Cancel the running CSV import"""
+        if self.importer is not None:
+            self.cancel_btn.setEnabled(False)
+            self.import_status.setText("Cancelling...")
+            self.importer.cancel()
+    
+    @pyqtSlot(int, float)
+    def on_import_progress(self, rows, rows_per_second):
+        """Show import progress"""
+        self.import_status.setText(f"{rows:,} rows imported ({rows_per_second:,.0f} rows/s)")
+    
+    @pyqtSlot(bool, str)
+    def on_import_finished(self, success, message):
+        """Report the result of the CSV import"""
+        self.progress_frame.setVisible(False)
+        self.import_status.setText(message)
         
         if success:
-            self.show_success("CSV data imported successfully!")
+            self.show_success(f"CSV data imported successfully! {message}")
             self.file_path.clear()
         else:
-            self.show_error("Failed to import CSV data. Check the file format.")
+            self.show_error(f"Failed to import CSV data. {message}")
+    
+    @pyqtSlot()
+    def on_import_thread_finished(self):
+        """Release the import worker once its thread has stopped"""
+        # finished is emitted from the thread just before it exits, so this
+        # wait returns right away and both objects can then be released
+        self.import_thread.wait()
+        self.import_thread = None
+        self.importer = None
+        self.upload_btn.setEnabled(True)
     
     def submit_manual_data(self):
         """Submit manually entered data"""